@@ -0,0 +1,387 @@
+'''
+aio_engine.py
+
+asyncio based download engine, an alternative to boss for download tasks
+all downloads run on one event loop in a background thread, rather than one blocking download per boss worker,
+so hundreds of concurrent downloads do not need hundreds of threads
+assigned Tasks wait in a priority queue ordered by priority then deadline, as in boss,
+and are downloaded by a fixed number of consumer coroutines
+
+requires Python 3.5+ and aiohttp
+
+Interfaces:
+    start(concurrency=100, host_concurrency=10, retry_policy=None, max_finished_tasks=100000, journal=None)
+    assign_task(task):
+    assign_tasks(tasks):
+    stop()
+    have_all_tasks_done():
+    wait_all(timeout=None):
+    stats():
+    tasks():
+
+Tasks are boss.Task instances created by streambot.create_download_task
+'''
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import aiohttp
+
+import boss
+import downloader
+
+logger = logging.getLogger('aio_engine.streambot')
+
+_CONCURRENCY = 100  # concurrent downloads in total
+_HOST_CONCURRENCY = 10  # concurrent downloads from one host
+_READ_TIMEOUT = 60  # seconds
+
+_GLOBAL_TASK_LOCK = threading.Lock()
+_ALL_TASKS_DONE = threading.Condition(_GLOBAL_TASK_LOCK)  # notified when no task is pending
+
+_LOOP = None  # event loop running in _LOOP_THREAD
+_LOOP_THREAD = None
+_SESSION = None  # aiohttp.ClientSession shared by all downloads
+_TASK_QUEUE = None  # asyncio.PriorityQueue of (-priority, deadline, sequence, Task), see boss._queue_entry()
+_RETRY_POLICY = boss.RetryPolicy()
+_JOURNAL = None  # journal.Journal recording finished Tasks, None if not journaling
+
+_TASKS = {}  # pending Tasks and summaries of recently finished Tasks, key: Task.id, value: Task object
+_FINISHED_TASKS = collections.deque()  # ids of finished Tasks in _TASKS, oldest first
+_MAX_FINISHED = boss._MAX_FINISHED_TASKS
+_TASK_COUNTS = {'pending': 0, 'done': 0, 'failed': 0}  # running number of _TASKS in each state
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+async def _open_session(concurrency, host_concurrency):
+    '''
+    open the shared session and the task queue, and start concurrency consumers of the queue
+    '''
+    global _TASK_QUEUE
+    _TASK_QUEUE = asyncio.PriorityQueue()
+    for _ in range(concurrency):
+        asyncio.get_event_loop().create_task(_consume_tasks())
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=host_concurrency, ssl=False)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=_READ_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def _consume_tasks():
+    while True:
+        entry = await _TASK_QUEUE.get()
+        await _run_task(entry[-1])
+
+
+async def _shutdown():
+    current = asyncio.current_task()
+    pending = [t for t in asyncio.all_tasks() if t is not current]
+    for t in pending:
+        t.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    await _SESSION.close()
+
+
+async def _throttle(uri, num_bytes=0, num_requests=0):
+    '''
+    wait until the host of uri allows the requests or the bytes, per downloader.set_rate_limit()
+    '''
+    wait = downloader._reserve(uri, num_bytes, num_requests)
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+def _make_folder(local):
+    subfolder = os.path.dirname(local)
+    if subfolder and not os.path.isdir(subfolder):
+        try:
+            os.makedirs(subfolder)
+        except OSError:
+            if not os.path.isdir(subfolder):
+                raise boss.TaskError('Failed create folder {subfolder}'.format(subfolder=subfolder), False)
+
+
+async def _download_range(command):
+    '''
+    download command['byterange'] of command['uri'] into the same offsets of command['local'], as downloader.download_range does
+    @param command Command of a download task
+    @raise boss.TaskError if download fails
+    '''
+    uri = command['uri']
+    local = command['local']
+    first, last = command['byterange']
+    _make_folder(local)
+    headers = {'Range': 'bytes={first}-{last}'.format(first=first, last=last), 'Accept-Encoding': 'identity'}
+    try:
+        await _throttle(uri, num_requests=1)
+        async with _SESSION.get(uri, headers=headers) as resp:
+            resp.raise_for_status()
+            # the server may ignore Range, the content before first is the same as local has
+            position = first if 206 == resp.status else 0
+            with os.fdopen(os.open(local, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+                f.seek(position)
+                async for chunk in resp.content.iter_chunked(command.get('chunk_size', downloader._CHUNK_SIZE)):
+                    chunk = chunk[:last + 1 - position]
+                    f.write(chunk)
+                    position += len(chunk)
+                    downloader._count_bytes(len(chunk))
+                    if position > last:
+                        break
+                    await _throttle(uri, num_bytes=len(chunk))
+    except aiohttp.ClientResponseError as e:
+        raise boss.TaskError('Failed download {uri}: {error}'.format(uri=uri, error=e), downloader._is_retryable_status(e.status))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise boss.TaskError('Failed download {uri}: {error}'.format(uri=uri, error=e), True)
+    except (IOError, OSError) as e:
+        raise boss.TaskError('Failed save {local}: {error}'.format(local=local, error=e), False)
+
+    if position <= last:
+        raise boss.TaskError('Bytes {first}-{last} of {uri} end at {position}'.format(first=first, last=last, uri=uri, position=position), True)
+
+
+async def _download(command):
+    '''
+    download command['uri'] to command['local'], as downloader.download does
+    response body is streamed in chunks to a partial file, which is renamed to local once complete
+    @param command Command of a download task
+    @raise boss.TaskError if download fails
+    '''
+    if command.get('byterange'):
+        return await _download_range(command)
+
+    uri = command['uri']
+    local = command['local']
+    partial = downloader._partial(local)
+    if command['clear_local']:
+        for path in (local, partial):
+            if os.path.exists(path):
+                os.remove(path)
+    elif os.path.exists(local):
+        logger.debug('{local} exists'.format(local=local))
+        return
+
+    _make_folder(local)
+    segment_cache = downloader._CACHE
+    use_cache = segment_cache and not command['clear_local']
+    if use_cache and segment_cache.get(uri, local):
+        return
+
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    headers = {}
+    if offset:
+        # byte offsets of the partial file refer to the identity encoded content
+        headers = {'Range': 'bytes={offset}-'.format(offset=offset), 'Accept-Encoding': 'identity'}
+
+    resp = None
+    try:
+        await _throttle(uri, num_requests=1)
+        async with _SESSION.get(uri, headers=headers) as resp:
+            if offset and 416 == resp.status:
+                if (None, offset) != downloader._content_range_total(resp):
+                    logger.debug('{partial} does not match {uri}, restart download'.format(partial=partial, uri=uri))
+                    os.remove(partial)
+                    return await _download(command)
+            else:
+                resp.raise_for_status()
+                content_range = downloader._content_range_total(resp)
+                resume = offset and 206 == resp.status and content_range and offset == content_range[0]
+                with open(partial, 'ab' if resume else 'wb') as f:
+                    async for chunk in resp.content.iter_chunked(command.get('chunk_size', downloader._CHUNK_SIZE)):
+                        f.write(chunk)
+                        downloader._count_bytes(len(chunk))
+                        await _throttle(uri, num_bytes=len(chunk))
+
+        os.rename(partial, local)
+        logger.debug('{uri} downloaded and saved to {local}'.format(uri=uri, local=local))
+        if use_cache:
+            # hashing a large file would hold up the event loop
+            await asyncio.get_event_loop().run_in_executor(None, segment_cache.put, uri, local)
+    except aiohttp.ClientResponseError as e:
+        raise boss.TaskError('Failed download {uri}: {error}'.format(uri=uri, error=e), downloader._is_retryable_status(e.status))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        if resp is not None and resp.headers.get('Content-Encoding') and os.path.exists(partial):
+            # decoded content can not be resumed by byte range
+            os.remove(partial)
+        raise boss.TaskError('Failed download {uri}: {error}'.format(uri=uri, error=e), True)
+    except (IOError, OSError) as e:
+        raise boss.TaskError('Failed save {local}: {error}'.format(local=local, error=e), False)
+
+
+def _queue_task(task):
+    _TASK_QUEUE.put_nowait(boss._queue_entry(task))
+
+
+async def _run_task(task):
+    '''
+    download task, queue it again after a backoff according to _RETRY_POLICY, or update _TASKS once finished
+    '''
+    task.attempts += 1
+    try:
+        await _download(task.command)
+        task.set_done()
+    except boss.TaskError as e:
+        logger.error('Task {task} error: {error}'.format(task=task.id, error=e))
+        task.retryable = e.retryable
+        task.set_failed()
+
+    if _RETRY_POLICY.should_retry(task):
+        # the consumer is not held by the backoff
+        task.status = 'START'
+        asyncio.get_event_loop().call_later(_RETRY_POLICY.delay(task.attempts), _queue_task, task)
+        return
+
+    if _JOURNAL:
+        _JOURNAL.record(task.id, task.state())
+        _JOURNAL.flush()
+
+    _GLOBAL_TASK_LOCK.acquire()
+    _TASK_COUNTS['pending'] -= 1
+    _TASK_COUNTS[task.state()] += 1
+    if task.id in _TASKS:
+        boss._keep_finished_task(task, _TASKS, _FINISHED_TASKS, _MAX_FINISHED)
+    if 0 == _TASK_COUNTS['pending']:
+        _ALL_TASKS_DONE.notify_all()
+    _GLOBAL_TASK_LOCK.release()
+
+
+def start(concurrency=_CONCURRENCY, host_concurrency=_HOST_CONCURRENCY, retry_policy=None, max_finished_tasks=boss._MAX_FINISHED_TASKS, journal=None):
+    '''
+    @param concurrency Max number of concurrent downloads, default 100
+    @param host_concurrency Max number of concurrent downloads from one host, default 10
+    @param retry_policy boss.RetryPolicy of failed downloads, default None, i.e. no retry
+    @param max_finished_tasks Number of finished tasks kept for dedup and tasks(), None to keep all, default 100000
+    @param journal journal.Journal to record the final state of each task in, default None
+    '''
+    global _TASKS, _MAX_FINISHED
+    _TASKS = {}
+    _FINISHED_TASKS.clear()
+    _MAX_FINISHED = max_finished_tasks
+    _TASK_COUNTS.update(pending=0, done=0, failed=0)
+
+    global _RETRY_POLICY, _JOURNAL
+    _RETRY_POLICY = retry_policy or boss.RetryPolicy()
+    _JOURNAL = journal
+
+    global _LOOP, _LOOP_THREAD, _SESSION
+    _LOOP = asyncio.new_event_loop()
+    _LOOP_THREAD = threading.Thread(target=_run_loop, args=(_LOOP,))
+    _LOOP_THREAD.daemon = True
+    _LOOP_THREAD.start()
+    _SESSION = asyncio.run_coroutine_threadsafe(_open_session(concurrency, host_concurrency), _LOOP).result()
+    logger.debug('start engine, concurrency {n}, {m} per host'.format(n=concurrency, m=host_concurrency))
+
+
+def stop():
+    '''
+    cancel unfinished downloads, close connections and stop event loop
+    '''
+    global _LOOP, _LOOP_THREAD, _SESSION, _TASK_QUEUE
+    if not _LOOP:
+        return
+    asyncio.run_coroutine_threadsafe(_shutdown(), _LOOP).result()
+    _LOOP.call_soon_threadsafe(_LOOP.stop)
+    _LOOP_THREAD.join()
+    _LOOP.close()
+    _LOOP = None
+    _LOOP_THREAD = None
+    _SESSION = None
+    _TASK_QUEUE = None
+
+
+def assign_task(task):
+    '''
+    Schedule download task on the event loop
+    @param task Task object
+    '''
+    if not assign_tasks([task]) and _LOOP:
+        logger.debug('task: {task_id} is processed'.format(task_id=task.id))
+
+
+def _start_tasks(tasks):
+    for task in tasks:
+        _queue_task(task)
+
+
+def assign_tasks(tasks):
+    '''
+    Queue a batch of download tasks by priority and deadline, under one lock and with one wakeup of the loop
+    tasks already assigned, including duplicates within the batch, are skipped
+    @param tasks Iterable of Task objects
+    @return Number of tasks scheduled
+    '''
+    if not _LOOP:
+        logger.error('Error _LOOP is None. start() the engine')
+        return 0
+
+    tasks = list(tasks)
+    new_tasks = []
+    _GLOBAL_TASK_LOCK.acquire()
+    for task in tasks:
+        if task.id in _TASKS:
+            continue
+        _TASKS[task.id] = task
+        _TASK_COUNTS[task.state()] += 1
+        new_tasks.append(task)
+    _GLOBAL_TASK_LOCK.release()
+
+    if new_tasks:
+        _LOOP.call_soon_threadsafe(_start_tasks, new_tasks)
+    return len(new_tasks)
+
+
+def have_all_tasks_done():
+    '''
+    Check whether all tasks done
+    @return True if all tasks done
+    '''
+    task_stats = stats()
+    progress_message = '**** [aio] {done}/{total} DONE {failed} Failed **** \r'.format(**task_stats)
+    sys.stdout.write(progress_message)
+    sys.stdout.flush()
+    return 0 == task_stats['pending']
+
+
+def wait_all(timeout=None):
+    '''
+    Block until all assigned tasks are done or failed
+    @param timeout Max seconds to wait, None to wait until all tasks done
+    @return True if all tasks done, False if timeout
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+    _ALL_TASKS_DONE.acquire()
+    try:
+        while _TASK_COUNTS['pending']:
+            if deadline is None:
+                _ALL_TASKS_DONE.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                _ALL_TASKS_DONE.wait(remaining)
+        return True
+    finally:
+        _ALL_TASKS_DONE.release()
+
+
+def stats():
+    '''
+    @return dict of number of tasks, keys: 'pending', 'done', 'failed' and 'total'
+    '''
+    _GLOBAL_TASK_LOCK.acquire()
+    task_stats = dict(_TASK_COUNTS)
+    _GLOBAL_TASK_LOCK.release()
+    task_stats['total'] = task_stats['pending'] + task_stats['done'] + task_stats['failed']
+    return task_stats
+
+
+def tasks():
+    '''
+    @return dict of pending Tasks and summaries of the latest finished Tasks, key: Task.id
+    '''
+    return _TASKS
@@ -2,25 +2,42 @@
 boss.py
 
 boss is zeromq based, multi-threading Task distributing framework
+workers are threads talking over inproc:// sockets, or processes talking over ipc:// sockets
+remote workers, started by "python boss.py worker --connect tcp://host:port", talk over tcp:// sockets
 
 Interfaces:
-    start(action, num_workers=3)
+    start(action, num_workers=3, mode='thread', bind=None, retry_policy=None, autoscale=None, max_finished_tasks=100000, journal=None)
     assign_task(task):
+    assign_tasks(tasks):
     stop()
     have_all_tasks_done():
+    wait_all(timeout=None):
+    stats():
     tasks():
+    run_worker(action, connect, num_workers=1, credit=1):
 
 
 Classes:
     Task
+    TaskError
+    RetryPolicy
+    AutoscalePolicy
 '''
 import time
+import json
+import collections
+import heapq
+import itertools
+import random
 import zmq
 import uuid
 import threading
+import multiprocessing
 import logging
 import signal
 import sys
+import os
+import tempfile
 
 
 logger = logging.getLogger('boss.streambot')
@@ -29,27 +46,64 @@ _CONTEXT = zmq.Context()
 
 
 _GLOBAL_TASK_LOCK = threading.Lock()
+_ALL_TASKS_DONE = threading.Condition(_GLOBAL_TASK_LOCK)  # notified when no task is pending
 _WORKER_TASK = 'WORKER_TASK'
 _WORKER_RESULT = 'WORKER_RESULT'
 _WORKER_ACK = 'WORKER_ACK'
-
-_WORKING_THREADS = []   # list of working threads
-
-_TASK_OUT_SOCKET = None  # PUSH socket for dispatching _TASKS to workers
-_TASKS = {}  # All tasks, key: Task.id, value: Task object
+_WORKER_COMMAND = '{id}'
+_WORKER_WAKEUP = 'inproc://WORKER_WAKEUP'
+_MODES = ('thread', 'process')
+_LINGER = 1000  # ms to flush pending messages when closing a socket
+_STOP_TIMEOUT = 10  # seconds to wait for a worker process to stop before terminating it
+_HEARTBEAT_INTERVAL = 1  # seconds between heartbeats of a worker
+_HEARTBEAT_LIVENESS = 3  # number of missed heartbeats before a worker is considered dead
+_MAX_RESULT_BATCH = 1000  # max number of results the sinker applies under one lock
+_READY = b'READY'  # worker to dispatcher: credits for more Tasks
+_WORKER_CREDIT = 1  # number of Tasks a worker holds at a time
+_MAX_FINISHED_TASKS = 100000  # number of finished Tasks kept for dedup and tasks(), the oldest are evicted beyond
+_HEARTBEAT = b'HEARTBEAT'  # worker to dispatcher: worker is alive
+_ENCODER = json.JSONEncoder(separators=(',', ':'))  # Task wire encoding, see _task_to_msg()
+_DECODER = json.JSONDecoder()
+_BYE = b'BYE'  # worker to dispatcher: worker is stopping, re-queue its unfinished Tasks
+
+_WORKING_THREADS = []   # list of working threads and processes
+_ENDPOINTS = {}  # zmq endpoints of boss sockets, key: 'task', 'result', 'ack' or 'command'
+_REMOTE_ENDPOINTS = {}  # tcp:// endpoints boss sockets also bind to for remote workers
+
+_TASK_QUEUE = []  # heap of Tasks waiting to be dispatched to workers, see _queue_task()
+_TASK_SEQUENCE = itertools.count()  # tie breaker keeping _TASK_QUEUE FIFO for same priority and deadline
+_RETRY_QUEUE = []  # heap of (retry time, sequence, Task) of failed Tasks waiting for retry
+_TASK_WAKEUP_SOCKET = None  # PUSH socket waking up the dispatcher when tasks are queued
+_TASKS = {}  # pending Tasks and summaries of recently finished Tasks, key: Task.id, value: Task object
+_FINISHED_TASKS = collections.deque()  # ids of finished Tasks in _TASKS, oldest first
+_MAX_FINISHED = _MAX_FINISHED_TASKS
+_TASK_COUNTS = {'pending': 0, 'done': 0, 'failed': 0}  # running number of _TASKS in each state
+_TASK_TIMES = {'finished': 0, 'seconds': 0.0}  # number of Tasks finished by workers and their total seconds in workers
+_SCALER = None  # _ScalerThread resizing local workers, None if not autoscaling
+_JOURNAL = None  # journal.Journal recording finished Tasks, None if not journaling
 
 
 class Task(object):
-    def __init__(self, task_id, command, status='START'):
+    # no per instance __dict__, as a live capture or a DASH SegmentTemplate creates Tasks by the hundred thousand
+    __slots__ = ('id', 'command', 'status', 'priority', 'deadline', 'attempts', 'retryable')
+
+    def __init__(self, task_id, command, status='START', priority=0, deadline=None):
         '''
         @param task_id Unique id for a task
         @param command An object
+        @param priority Tasks of higher priority are dispatched first, default 0
+        @param deadline time.time() by when the task should be done, tasks of the same priority
+                        are dispatched earliest deadline first, default None, i.e. no deadline
 
         'STOP' status reserved for stopping working thread
         '''
         self.id = task_id
         self.command = command
         self.status = status
+        self.priority = priority
+        self.deadline = deadline
+        self.attempts = 0  # number of times the task has been dispatched
+        self.retryable = True  # False if the task failed in a way retrying can not fix
 
     def set_done(self):
         self.status = 'DONE'
@@ -63,34 +117,182 @@ class Task(object):
     def is_failed(self):
         return 'FAILED' == self.status
 
+    def state(self):
+        '''
+        @return 'done', 'failed' or 'pending', the key of the task in _TASK_COUNTS
+        '''
+        if self.is_done():
+            return 'done'
+        if self.is_failed():
+            return 'failed'
+        return 'pending'
+
     def __repr__(self):
         return 'task {id}: stauts {status}'.format(id=self.id, status=self.status)
 
 
+def _finished_summary(task):
+    '''
+    @return Task of the same id, status and attempts, without command, to keep once task is finished
+    '''
+    summary = Task(task.id, None, task.status, task.priority, task.deadline)
+    summary.attempts = task.attempts
+    summary.retryable = task.retryable
+    return summary
+
+
+def _keep_finished_task(task, tasks, finished_ids, max_finished):
+    '''
+    put the summary of finished task to tasks, and evict the oldest finished Tasks from tasks beyond max_finished
+    the lock of tasks must be held
+    @param tasks dict of Tasks, key: Task.id
+    @param finished_ids deque of ids of finished Tasks in tasks, oldest first
+    @param max_finished Max number of finished Tasks kept, None to keep all
+    '''
+    tasks[task.id] = _finished_summary(task)
+    finished_ids.append(task.id)
+    while max_finished is not None and len(finished_ids) > max_finished:
+        task_id = finished_ids.popleft()
+        if task_id in tasks and 'pending' != tasks[task_id].state():
+            del tasks[task_id]
+
+
+def _task_to_msg(task):
+    '''
+    @return bytes sent over sockets, values of Task.__slots__ in order as a JSON array without spaces
+    '''
+    return _ENCODER.encode((task.id, task.command, task.status, task.priority, task.deadline, task.attempts, task.retryable)).encode('utf-8')
+
+
+def _task_from_msg(task_msg):
+    '''
+    @param task_msg bytes of _task_to_msg() received from socket
+    @return Task
+    '''
+    task_id, command, status, priority, deadline, attempts, retryable = _DECODER.decode(task_msg.decode('utf-8'))
+    task = Task(task_id, command, status, priority, deadline)
+    task.attempts = attempts
+    task.retryable = retryable
+    return task
+
+
+class TaskError(Exception):
+    '''
+    raised by action to fail a Task
+    retryable False indicating retrying the Task would fail again, e.g. HTTP 404
+    '''
+    def __init__(self, value, retryable=True):
+        self.value = value
+        self.retryable = retryable
+
+    def __str__(self):
+        return repr(self.value)
+
+
+class RetryPolicy(object):
+    '''
+    How failed Tasks are retried
+    '''
+    def __init__(self, max_attempts=1, backoff=1, max_backoff=60, jitter=0.5):
+        '''
+        @param max_attempts Max number of times a Task is tried, default 1, i.e. no retry
+        @param backoff Seconds before the first retry, doubled for every further retry, default 1
+        @param max_backoff Max seconds before a retry, default 60
+        @param jitter Max fraction randomly taken off the backoff, so Tasks failed together are not retried together, default 0.5
+        '''
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def should_retry(self, task):
+        return task.is_failed() and task.retryable and task.attempts < self.max_attempts
+
+    def delay(self, attempts):
+        '''
+        @param attempts Number of times the Task has been tried
+        @return seconds to wait before next try
+        '''
+        backoff = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        return backoff * (1 - self.jitter * random.random())
+
+
+_RETRY_POLICY = RetryPolicy()
+
+
+class AutoscalePolicy(object):
+    '''
+    How the pool of local workers grows and shrinks at runtime
+    '''
+    def __init__(self, min_workers=1, max_workers=10, interval=5, step=1, min_gain=0.1, throughput=None):
+        '''
+        @param min_workers Min number of local workers, default 1
+        @param max_workers Max number of local workers, default 10
+        @param interval Seconds between two resizings, default 5
+        @param step Number of workers added or retired at a time, default 1
+        @param min_gain Min fraction throughput has to grow by after workers are added,
+                        otherwise they are retired and the pool stops growing, default 0.1
+        @param throughput Function returning the total amount of work done so far, e.g. downloader.bytes_downloaded,
+                          default None, i.e. number of finished Tasks
+        '''
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.interval = interval
+        self.step = step
+        self.min_gain = min_gain
+        self.throughput = throughput
+
+    def target(self, num_workers, backlog, busy, ceiling=None):
+        '''
+        @param num_workers Current number of workers
+        @param backlog Number of Tasks waiting for a worker
+        @param busy Average number of busy workers
+        @param ceiling Number of workers more of which did not raise throughput, None if not known
+        @return number of workers wanted
+        '''
+        max_workers = self.max_workers if ceiling is None else min(self.max_workers, ceiling)
+        if backlog > 0:
+            wanted = num_workers + self.step
+        elif busy < num_workers - self.step:
+            wanted = num_workers - self.step
+        else:
+            wanted = num_workers
+        return max(self.min_workers, min(max_workers, wanted))
+
+
 class _WorkerThread(threading.Thread):
     '''
     boss's worker thread
 
-    read Task from task_in socket, which binds to inproc://WORKER_TASK
-    send Task result to result_out socket, which binds to inproc://WORKER_RESULT
-    also sync to client via worker_ack_out socket, wich binds to inproc://WORKER_ACK
-    also command socket, which binds to inproc://{id}
+    ask for and read Task from task_in socket, which connects to _ENDPOINTS['task'], e.g. inproc://WORKER_TASK
+    push Task result to result_out socket, which connects to _ENDPOINTS['result'], without waiting for the sinker
+    also sync to client via worker_ack_out socket, which connects to _ENDPOINTS['ack']
+    also command socket, which binds to _ENDPOINTS['command'], e.g. inproc://{id}
 
     action is the Task handler: bool(Task). This is a blocking call.
     '''
-    def __init__(self, action):
+    def __init__(self, action, context=_CONTEXT, endpoints=None, worker_id=None, heartbeat=False, credit=_WORKER_CREDIT):
         '''
         @param action A function implements "bool (Task)"
+        @param context zmq context sockets are created in, default is boss's context
+        @param endpoints dict of endpoints to connect to, default is _ENDPOINTS
+        @param worker_id Default is a new uuid
+        @param heartbeat True to send heartbeats, so boss re-queues tasks of the worker if it dies
+        @param credit Max number of Tasks sent to the worker ahead, default 1
         '''
         threading.Thread.__init__(self)
-        self.id = uuid.uuid4()
-        self.task_in = _CONTEXT.socket(zmq.PULL)
-        self.result_out = _CONTEXT.socket(zmq.REQ)
-        self.worker_ack_out = _CONTEXT.socket(zmq.REQ)
-        self.command_in = _CONTEXT.socket(zmq.PULL)
-        self.command_out = _CONTEXT.socket(zmq.PUSH)
-        self.command_in.connect('inproc://{id}'.format(id=self.id))
-        self.command_out.bind('inproc://{id}'.format(id=self.id))
+        self.id = worker_id or uuid.uuid4()
+        self.endpoints = endpoints or _ENDPOINTS
+        self.context = context
+        self.heartbeat = heartbeat
+        self.credit = credit
+        self.task_in = context.socket(zmq.DEALER)
+        self.task_in.setsockopt(zmq.IDENTITY, str(self.id).encode('utf-8'))
+        self.result_out = context.socket(zmq.PUSH)
+        self.worker_ack_out = context.socket(zmq.REQ)
+        self.command_in = context.socket(zmq.PULL)
+        self.command_endpoint = self.endpoints['command'].format(id=self.id)
+        self.command_in.bind(self.command_endpoint)
         self.poller = zmq.Poller()
         self.poller.register(self.command_in, zmq.POLLIN)
         self.poller.register(self.task_in, zmq.POLLIN)
@@ -99,49 +301,101 @@ class _WorkerThread(threading.Thread):
         logger.debug('create worker [{id}]'.format(id=self.id))
 
     def run(self):
+        heartbeat_thread = None
         try:
             # init sockets
-            self.task_in.connect('inproc://{proc_name}'.format(proc_name=_WORKER_TASK))
-            self.result_out.connect('inproc://{proc_name}'.format(proc_name=_WORKER_RESULT))
+            self.task_in.connect(self.endpoints['task'])
+            self.result_out.connect(self.endpoints['result'])
 
             # sync worker to boss
-            self.worker_ack_out.connect('inproc://{proc_name}'.format(proc_name=_WORKER_ACK))
+            self.worker_ack_out.connect(self.endpoints['ack'])
             self.worker_ack_out.send(b'')
             logger.debug('waiting to start worker [{id}]'.format(id=self.id))
             self.worker_ack_out.recv()  # blocking wait client to response, then start working process
             logger.debug('worker [{id}] stats'.format(id=self.id))
 
+            if self.heartbeat:
+                heartbeat_thread = _HeartbeatThread(self.id, self.context, self.endpoints['task'])
+                heartbeat_thread.start()
+
             # main working loop
+            self._ready(credit=self.credit, idle=True)
             while True:
                 logger.debug('worker [{id}] is waiting for task'.format(id=self.id))
-                socks = dict(self.poller.poll())
+                socks = dict(self.poller.poll(_HEARTBEAT_INTERVAL * 1000))
+                if not socks:
+                    # idle, offer all credits again in case boss has restarted
+                    self._ready(credit=self.credit, idle=True)
+                    continue
+
                 if self.command_in in socks and socks[self.command_in] == zmq.POLLIN:
                     logger.debug('stop() received')
                     break
 
                 if self.task_in in socks and socks[self.task_in] == zmq.POLLIN:
-                    task_msg = self.task_in.recv_json()
-                    logger.debug('receive task_msg: {msg}'.format(msg=task_msg))
-                    if 'STOP' == task_msg['status']:
+                    # a worker with several credits may get several Tasks in one message, one per frame
+                    tasks = [_task_from_msg(task_msg) for task_msg in self.task_in.recv_multipart()]
+                    if not self._run_tasks(tasks):
                         break
 
-                    task = Task(task_msg['id'], task_msg['command'])
-                    logger.debug('worker [{id}] is working on {task}'.format(id=self.id, task=task.id))
-
-                    if self.action(task):
-                        logger.debug('worker [{id}]: Task done'.format(id=self.id))
-                        task.set_done()
-                    else:
-                        logger.debug('worker [{id}]: Task failed'.format(id=self.id))
-                        task.set_failed()
+            # Tasks sent to the worker but not run yet go back to the queue
+            self.task_in.send_multipart([_BYE, b''])
+        except Exception as e:
+            logger.error('Error in worker [{id}]'.format(id=self.id))
+            logger.exception(e)
+        finally:
+            if heartbeat_thread:
+                heartbeat_thread.stop()
+                heartbeat_thread.join()
+            _close_sockets(self.task_in, self.result_out, self.worker_ack_out, self.command_in)
 
-                    self.result_out.send_json(task.__dict__)
+    def _run_tasks(self, tasks):
+        '''
+        run tasks in order, send each result and READY for one more Task as soon as it is finished
+        @return False if the worker is told to stop, Tasks not run are put back to the queue by BYE
+        '''
+        for task in tasks:
+            if 'STOP' == task.status or self.command_in.poll(0):
+                return False
+
+            logger.debug('worker [{id}] is working on {task}'.format(id=self.id, task=task.id))
+
+            if self._run_action(task):
+                logger.debug('worker [{id}]: Task done'.format(id=self.id))
+                task.set_done()
+            else:
+                logger.debug('worker [{id}]: Task failed'.format(id=self.id))
+                task.set_failed()
+
+            logger.debug('worker [{id}] is sending out result'.format(id=self.id))
+            self.result_out.send(_task_to_msg(task))
+            self._ready(task.id, credit=1)
+        return True
 
-                    logger.debug('worker [{id}] is sending out result'.format(id=self.id))
-                    self.result_out.recv()
+    def _run_action(self, task):
+        '''
+        @return result of action, False if action raises, and task.retryable is set accordingly
+        '''
+        try:
+            return self.action(task)
+        except TaskError as e:
+            logger.error('worker [{id}]: Task {task} error: {error}'.format(id=self.id, task=task.id, error=e))
+            task.retryable = e.retryable
         except Exception as e:
-            logger.error('Error in worker [{id}]'.format(id=self.id))
+            logger.error('worker [{id}]: unexpected error in Task {task}'.format(id=self.id, task=task.id))
             logger.exception(e)
+            task.retryable = False
+        return False
+
+    def _ready(self, finished_task_id=None, credit=1, idle=False):
+        '''
+        give the dispatcher credits for more tasks
+        @param finished_task_id id of the task just finished, None if not any
+        @param credit Number of more tasks the worker takes
+        @param idle True if the worker holds no task, so credit is all credits of the worker
+        '''
+        ready_msg = {'finished': finished_task_id, 'credit': credit, 'idle': idle}
+        self.task_in.send_multipart([_READY, json.dumps(ready_msg).encode('utf-8')])
 
     def stop(self):
         '''
@@ -150,20 +404,296 @@ class _WorkerThread(threading.Thread):
         worker.stop()
         worker.join()
         '''
-        self.command_out.send('STOP')
+        _send_command(self.command_endpoint, b'STOP')
+
+
+class _WorkerProcess(multiprocessing.Process):
+    '''
+    boss's worker process
+
+    runs the _WorkerThread working loop in a child process, with its own zmq context
+    so CPU bound actions are not serialised by the GIL
+    endpoints must be ipc:// or tcp://, as inproc:// does not cross processes
+    '''
+    def __init__(self, action, endpoints):
+        '''
+        @param action A module level function implements "bool (Task)"
+        @param endpoints dict of endpoints to connect to
+        '''
+        multiprocessing.Process.__init__(self)
+        self.id = uuid.uuid4()
+        self.action = action
+        self.endpoints = endpoints
+        self.command_endpoint = endpoints['command'].format(id=self.id)
+        logger.debug('create worker process [{id}]'.format(id=self.id))
+
+    def run(self):
+        context = zmq.Context()
+        worker = _WorkerThread(self.action, context, self.endpoints, self.id, heartbeat=True)
+        worker.run()
+        context.term()
+
+    def stop(self):
+        '''
+        send STOP to the worker process, terminate it if it does not stop in time
+        '''
+        _send_command(self.command_endpoint, b'STOP')
+        self.join(_STOP_TIMEOUT)
+        if self.is_alive():
+            logger.error('worker process [{id}] does not stop, terminate it'.format(id=self.id))
+            self.terminate()
+
+
+class _HeartbeatThread(threading.Thread):
+    '''
+    send heartbeats of a worker to the dispatcher every _HEARTBEAT_INTERVAL seconds,
+    also while the worker is blocked in its action
+    '''
+    def __init__(self, worker_id, context, endpoint):
+        '''
+        @param worker_id id of the worker
+        @param context zmq context of the worker
+        @param endpoint task endpoint of the dispatcher
+        '''
+        threading.Thread.__init__(self)
+        self.id = worker_id
+        self.context = context
+        self.endpoint = endpoint
+        self.stopped = threading.Event()
+
+    def run(self):
+        heartbeat_out = self.context.socket(zmq.DEALER)
+        try:
+            heartbeat_out.connect(self.endpoint)
+            while not self.stopped.is_set():
+                heartbeat_out.send_multipart([_HEARTBEAT, str(self.id).encode('utf-8')])
+                self.stopped.wait(_HEARTBEAT_INTERVAL)
+        except Exception as e:
+            logger.error('Error in heartbeat of worker [{id}]'.format(id=self.id))
+            logger.exception(e)
+        finally:
+            heartbeat_out.close(linger=0)
+
+    def stop(self):
+        self.stopped.set()
+
+
+class _DispatcherThread(threading.Thread):
+    '''
+    Dispatcher thread
+
+    route Tasks of _TASK_QUEUE, highest priority and then earliest deadline first,
+    to workers with credits via task_out socket, which binds to _ENDPOINTS['task']
+    workers send READY with credits for more Tasks, and the id of the Task they have just finished,
+    so Tasks wait in _TASK_QUEUE rather than in workers' sockets, where they can not be overtaken
+    workers started with heartbeat are considered dead if silent for _HEARTBEAT_LIVENESS heartbeats,
+    their unfinished Tasks are put back to _TASK_QUEUE, as are those of workers saying BYE
+    seconds from dispatching a Task to its READY are added to _TASK_TIMES for autoscaling
+    also reply worker acks in ack_in socket, for remote workers joining after start()
+    '''
+    def __init__(self, ack_in):
+        '''
+        @param ack_in worker ack in socket, binds to _ENDPOINTS['ack']
+        '''
+        threading.Thread.__init__(self)
+        self.id = uuid.uuid4()
+        self.ack_in = ack_in
+        self.task_out = _CONTEXT.socket(zmq.ROUTER)
+        self.wakeup_in = _CONTEXT.socket(zmq.PULL)
+        self.wakeup_in.bind(_WORKER_WAKEUP)
+        self.command_in = _CONTEXT.socket(zmq.PULL)
+        self.command_out = _CONTEXT.socket(zmq.PUSH)
+        self.command_in.connect('inproc://{id}'.format(id=self.id))
+        self.command_out.bind('inproc://{id}'.format(id=self.id))
+        self.poller = zmq.Poller()
+        self.poller.register(self.command_in, zmq.POLLIN)
+        self.poller.register(self.task_out, zmq.POLLIN)
+        self.poller.register(self.wakeup_in, zmq.POLLIN)
+        self.poller.register(self.ack_in, zmq.POLLIN)
+
+        self.workers = {}  # key: worker identity, value: _WorkerState
+        self.ready_workers = collections.deque()  # identities of workers with credits
+        self.departed = {}  # workers said BYE, whose late heartbeats are ignored, key: worker identity, value: time.time() of BYE
+        logger.debug('create dispatcher [{id}]'.format(id=self.id))
+
+    def run(self):
+        try:
+            _bind(self.task_out, 'task')
+
+            while True:
+                socks = dict(self.poller.poll(self._poll_timeout()))
+                if self.command_in in socks and socks[self.command_in] == zmq.POLLIN:
+                    logger.debug('stop() received')
+                    break
+
+                if self.ack_in in socks and socks[self.ack_in] == zmq.POLLIN:
+                    self.ack_in.recv()
+                    self.ack_in.send(b'')
+                    logger.debug('dispatcher [{id}] synced with a joining worker'.format(id=self.id))
+
+                if self.wakeup_in in socks and socks[self.wakeup_in] == zmq.POLLIN:
+                    _drain(self.wakeup_in)
+
+                if self.task_out in socks and socks[self.task_out] == zmq.POLLIN:
+                    self._receive_worker_messages()
+
+                self._purge_dead_workers()
+                self._queue_due_retries()
+                self._dispatch()
+
+        except Exception as e:
+            logger.error('Error in dispatcher [{id}]'.format(id=self.id))
+            logger.exception(e)
+        finally:
+            _unbind(self.task_out, 'task')
+            _unbind(self.ack_in, 'ack')
+            self.wakeup_in.unbind(_WORKER_WAKEUP)
+            _close_sockets(self.task_out, self.wakeup_in, self.ack_in, self.command_in)
+
+    def _poll_timeout(self):
+        '''
+        @return ms to wait for messages, until next heartbeat check or next retry
+        '''
+        timeout = _HEARTBEAT_INTERVAL
+        _GLOBAL_TASK_LOCK.acquire()
+        if _RETRY_QUEUE:
+            timeout = max(0, min(timeout, _RETRY_QUEUE[0][0] - time.time()))
+        _GLOBAL_TASK_LOCK.release()
+        return int(timeout * 1000)
+
+    def _queue_due_retries(self):
+        now = time.time()
+        _GLOBAL_TASK_LOCK.acquire()
+        while _RETRY_QUEUE and _RETRY_QUEUE[0][0] <= now:
+            _queue_task(heapq.heappop(_RETRY_QUEUE)[-1])
+        _GLOBAL_TASK_LOCK.release()
+
+    def _worker(self, identity):
+        if identity not in self.workers:
+            logger.debug('worker [{id}] joins'.format(id=identity))
+            self.workers[identity] = _WorkerState()
+        worker = self.workers[identity]
+        worker.last_seen = time.time()
+        return worker
+
+    def _receive_worker_messages(self):
+        while True:
+            try:
+                identity, kind, payload = self.task_out.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            if _HEARTBEAT == kind:
+                # heartbeats come from a separate socket, payload is the worker identity
+                if payload not in self.departed:
+                    self._worker(payload).heartbeat = True
+            elif _READY == kind:
+                # a worker may join again under the same identity
+                self.departed.pop(identity, None)
+                worker = self._worker(identity)
+                ready_msg = json.loads(payload.decode('utf-8'))
+                if ready_msg['finished'] is not None:
+                    self._finish_task(worker, ready_msg['finished'])
+                if ready_msg['idle']:
+                    worker.credit = max(worker.credit, ready_msg['credit'] - len(worker.tasks))
+                else:
+                    worker.credit += ready_msg['credit']
+                if worker.credit > 0 and identity not in self.ready_workers:
+                    self.ready_workers.append(identity)
+            elif _BYE == kind:
+                logger.debug('worker [{id}] leaves'.format(id=identity))
+                self.departed[identity] = time.time()
+                self._remove_workers([identity])
+
+    def _finish_task(self, worker, task_id):
+        task = worker.tasks.pop(task_id, None)
+        dispatched = worker.dispatch_times.pop(task_id, None)
+        if task is None or dispatched is None:
+            return
+        _GLOBAL_TASK_LOCK.acquire()
+        _TASK_TIMES['finished'] += 1
+        _TASK_TIMES['seconds'] += time.time() - dispatched
+        _GLOBAL_TASK_LOCK.release()
+
+    def _purge_dead_workers(self):
+        deadline = time.time() - _HEARTBEAT_INTERVAL * _HEARTBEAT_LIVENESS
+        dead_workers = [k for k, v in self.workers.items() if v.heartbeat and v.last_seen < deadline]
+        for identity in dead_workers:
+            logger.error('worker [{id}] is dead'.format(id=identity))
+        self._remove_workers(dead_workers)
+        # heartbeats sent before BYE arrive within the liveness period
+        for identity in [k for k, v in self.departed.items() if v < deadline]:
+            del self.departed[identity]
+
+    def _remove_workers(self, identities):
+        '''
+        forget workers and put their unfinished tasks back to _TASK_QUEUE
+        '''
+        for identity in identities:
+            worker = self.workers.pop(identity, None)
+            if worker is None:
+                continue
+            logger.debug('re-queue {n} tasks of worker [{id}]'.format(id=identity, n=len(worker.tasks)))
+            _GLOBAL_TASK_LOCK.acquire()
+            for task in worker.tasks.values():
+                _queue_task(task)
+            _GLOBAL_TASK_LOCK.release()
+        if identities:
+            self.ready_workers = collections.deque(x for x in self.ready_workers if x in self.workers)
+
+    def _dispatch(self):
+        '''
+        send each ready worker as many Tasks as its credits allow, in one message
+        '''
+        while self.ready_workers:
+            identity = self.ready_workers[0]
+            worker = self.workers[identity]
+            _GLOBAL_TASK_LOCK.acquire()
+            tasks = [heapq.heappop(_TASK_QUEUE)[-1] for i in range(min(worker.credit, len(_TASK_QUEUE)))]
+            _GLOBAL_TASK_LOCK.release()
+            if not tasks:
+                break
+
+            self.ready_workers.popleft()
+            worker.credit -= len(tasks)
+            if worker.credit > 0:
+                self.ready_workers.append(identity)
+            now = time.time()
+            for task in tasks:
+                worker.tasks[task.id] = task
+                worker.dispatch_times[task.id] = now
+                task.attempts += 1
+            logger.debug('send {n} tasks to worker [{id}]'.format(n=len(tasks), id=identity))
+            self.task_out.send_multipart([identity] + [_task_to_msg(task) for task in tasks])
+
+    def stop(self):
+        self.command_out.send(b'STOP')
+
+
+class _WorkerState(object):
+    '''
+    what the dispatcher knows about a worker
+    '''
+    def __init__(self):
+        self.last_seen = time.time()
+        self.heartbeat = False  # True if the worker sends heartbeats
+        self.credit = 0  # Number of Tasks the worker can take
+        self.tasks = {}  # Tasks dispatched to the worker and not finished, key: Task.id
+        self.dispatch_times = {}  # time.time() the Tasks are dispatched, key: Task.id
 
 
 class _SinkerThread(threading.Thread):
     '''
     Sinker thread
 
-    receive Task result from result_in socket, which binds to inproc://WORKER_RESULT
-    update global _TASKS dict
+    pull Task results from result_in socket, which binds to _ENDPOINTS['result']
+    update global _TASKS dict, with all results pending in result_in as one batch
+    finished Tasks are kept as summaries without command, and only the latest _MAX_FINISHED of them
     '''
     def __init__(self):
         threading.Thread.__init__(self)
         self.id = uuid.uuid4()
-        self.result_in = _CONTEXT.socket(zmq.REP)
+        self.result_in = _CONTEXT.socket(zmq.PULL)
         self.command_in = _CONTEXT.socket(zmq.PULL)
         self.command_out = _CONTEXT.socket(zmq.PUSH)
         self.command_in.connect('inproc://{id}'.format(id=self.id))
@@ -175,8 +705,7 @@ class _SinkerThread(threading.Thread):
 
     def run(self):
         try:
-            global _TASKS
-            self.result_in.bind('inproc://{proc_name}'.format(proc_name=_WORKER_RESULT))
+            _bind(self.result_in, 'result')
 
             while True:
                 socks = dict(self.poller.poll())
@@ -185,27 +714,321 @@ class _SinkerThread(threading.Thread):
                     break
 
                 if self.result_in in socks and socks[self.result_in] == zmq.POLLIN:
-                    task_msg = self.result_in.recv_json()
-
-                    task = Task(task_msg['id'], task_msg['command'], task_msg['status'])
-                    logger.debug('sink [{id}] received result of task {task_id}'.format(id=self.id, task_id=task.id))
+                    results = self._receive_results()
+                    logger.debug('sink [{id}] received {n} results'.format(id=self.id, n=len(results)))
                     _GLOBAL_TASK_LOCK.acquire()
-                    _TASKS[task.id] = task
+                    for task in results:
+                        if task.id not in _TASKS or 'pending' != _TASKS[task.id].state():
+                            # late duplicate result of a Task already finished, possibly evicted from _TASKS
+                            logger.debug('ignore result of finished task {task}'.format(task=task.id))
+                            continue
+                        if _RETRY_POLICY.should_retry(task):
+                            _retry_task(task)
+                        _TASK_COUNTS['pending'] -= 1
+                        _TASK_COUNTS[task.state()] += 1
+                        if task.is_done() or task.is_failed():
+                            if _JOURNAL:
+                                _JOURNAL.record(task.id, task.state())
+                            _keep_finished_task(task, _TASKS, _FINISHED_TASKS, _MAX_FINISHED)
+                        else:
+                            _TASKS[task.id] = task
+                    if 0 == _TASK_COUNTS['pending']:
+                        _ALL_TASKS_DONE.notify_all()
                     _GLOBAL_TASK_LOCK.release()
-                    self.result_in.send(b'')
+                    if _JOURNAL:
+                        # one write per batch of results
+                        _JOURNAL.flush()
 
         except Exception as e:
             logger.error('Error in sink [{id}]'.format(id=self.id))
             logger.exception(e)
+        finally:
+            _unbind(self.result_in, 'result')
+            _close_sockets(self.result_in, self.command_in)
+
+    def _receive_results(self):
+        '''
+        drain result_in without blocking
+        @return list of Task results
+        '''
+        results = []
+        while len(results) < _MAX_RESULT_BATCH:
+            try:
+                task_msg = self.result_in.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            results.append(_task_from_msg(task_msg))
+        return results
 
     def stop(self):
-        self.command_out.send('STOP')
+        self.command_out.send(b'STOP')
+
+
+_Sample = collections.namedtuple('_Sample', 'time throughput task_seconds backlog in_flight')
+
+
+class _ScalerThread(threading.Thread):
+    '''
+    Autoscaling thread
+
+    every policy.interval seconds, measure queue depth, busy workers and throughput,
+    then start or retire local workers within policy.min_workers and policy.max_workers
+    busy workers are the seconds Tasks spent in workers per second, or the Tasks in workers now if more
+    workers are added while Tasks wait in _TASK_QUEUE, and kept only if throughput grows by policy.min_gain,
+    otherwise the pool stops growing, e.g. for a slow origin, until there is no backlog again
+    retired workers finish the Task at hand, and their Tasks not started yet are re-queued
+    '''
+    def __init__(self, policy, action, mode, workers):
+        '''
+        @param policy AutoscalePolicy
+        @param action bool(Task) of the workers
+        @param mode 'thread' or 'process'
+        @param workers list of local workers started by start()
+        '''
+        threading.Thread.__init__(self)
+        self.id = uuid.uuid4()
+        self.policy = policy
+        self.throughput = policy.throughput or _finished_tasks
+        self.action = action
+        self.mode = mode
+        self.workers = list(workers)
+        self.retired_workers = []  # retired workers still finishing their Tasks
+        self.probe = None  # (number of workers, throughput) before workers are added, None if not growing
+        self.ceiling = None  # number of workers more of which did not raise throughput
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            last = self._sample()
+            while not self.stopped.is_set():
+                self.stopped.wait(self.policy.interval)
+                if self.stopped.is_set():
+                    break
+                sample = self._sample()
+                elapsed = max(sample.time - last.time, 1e-6)
+                rate = (sample.throughput - last.throughput) / elapsed
+                busy = max(sample.in_flight, (sample.task_seconds - last.task_seconds) / elapsed)
+                self._resize(self._wanted_workers(sample.backlog, busy, rate))
+                self._join_retired_workers()
+                last = sample
+        except Exception as e:
+            logger.error('Error in scaler [{id}]'.format(id=self.id))
+            logger.exception(e)
+        finally:
+            for worker in self.retired_workers:
+                worker.join()
+
+    def _sample(self):
+        throughput = self.throughput()
+        _GLOBAL_TASK_LOCK.acquire()
+        sample = _Sample(time.time(), throughput, _TASK_TIMES['seconds'], len(_TASK_QUEUE),
+                         _TASK_COUNTS['pending'] - len(_TASK_QUEUE) - len(_RETRY_QUEUE))
+        _GLOBAL_TASK_LOCK.release()
+        return sample
+
+    def _wanted_workers(self, backlog, busy, rate):
+        '''
+        @param backlog Number of Tasks waiting for a worker
+        @param busy Average number of busy workers
+        @param rate Throughput per second since last resizing
+        @return number of workers wanted
+        '''
+        num_workers = len(self.workers)
+        if self.probe is not None and backlog > 0:
+            last_num_workers, last_rate = self.probe
+            if rate < last_rate * (1 + self.policy.min_gain):
+                logger.debug('{n} workers do not raise throughput {rate:.1f}/s, stop growing'.format(n=num_workers, rate=rate))
+                self.probe = None
+                self.ceiling = last_num_workers
+                return last_num_workers
+        self.probe = None
+
+        if 0 == backlog:
+            self.ceiling = None
+        target = self.policy.target(num_workers, backlog, busy, self.ceiling)
+        if target > num_workers:
+            self.probe = (num_workers, rate)
+        return target
+
+    def _resize(self, target):
+        if target != len(self.workers):
+            logger.debug('resize workers from {n} to {target}'.format(n=len(self.workers), target=target))
+        while len(self.workers) < target:
+            self.workers.append(_start_worker(self.action, self.mode))
+        while len(self.workers) > target:
+            worker = self.workers.pop()
+            _WORKING_THREADS.remove(worker)
+            _send_command(worker.command_endpoint, b'STOP')
+            self.retired_workers.append(worker)
+
+    def _join_retired_workers(self):
+        for worker in [x for x in self.retired_workers if not x.is_alive()]:
+            worker.join()
+            self.retired_workers.remove(worker)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def _finished_tasks():
+    '''
+    @return number of Tasks finished by workers, default throughput of AutoscalePolicy
+    '''
+    _GLOBAL_TASK_LOCK.acquire()
+    finished = _TASK_TIMES['finished']
+    _GLOBAL_TASK_LOCK.release()
+    return finished
+
+
+def _start_worker(action, mode):
+    '''
+    start a local worker, which syncs via _ENDPOINTS['ack']
+    @return _WorkerThread or _WorkerProcess
+    '''
+    if 'process' == mode:
+        worker = _WorkerProcess(action, _ENDPOINTS)
+    else:
+        worker = _WorkerThread(action=action)
+    _WORKING_THREADS.append(worker)
+    worker.start()
+    return worker
+
+
+def _close_sockets(*sockets):
+    '''
+    close sockets owned by a finishing thread, so their endpoints can be bound again by next start()
+    '''
+    for socket in sockets:
+        socket.close(linger=_LINGER)
+
+
+def _queue_entry(task):
+    deadline = task.deadline if task.deadline is not None else float('inf')
+    return (-task.priority, deadline, next(_TASK_SEQUENCE), task)
+
+
+def _queue_task(task):
+    '''
+    push task to _TASK_QUEUE, _GLOBAL_TASK_LOCK must be held
+    '''
+    heapq.heappush(_TASK_QUEUE, _queue_entry(task))
+
+
+def _queue_tasks(tasks):
+    '''
+    push tasks to _TASK_QUEUE, _GLOBAL_TASK_LOCK must be held
+    a batch larger than the queue is added by one heapify, rather than one push per task
+    '''
+    if len(tasks) > len(_TASK_QUEUE):
+        _TASK_QUEUE.extend(_queue_entry(task) for task in tasks)
+        heapq.heapify(_TASK_QUEUE)
+    else:
+        for task in tasks:
+            heapq.heappush(_TASK_QUEUE, _queue_entry(task))
+
+
+def _retry_task(task):
+    '''
+    put failed task to _RETRY_QUEUE with backoff, _GLOBAL_TASK_LOCK must be held
+    '''
+    delay = _RETRY_POLICY.delay(task.attempts)
+    logger.debug('retry task {task} in {delay:.1f} seconds, attempt {n}'.format(task=task.id, delay=delay, n=task.attempts + 1))
+    task.status = 'START'
+    heapq.heappush(_RETRY_QUEUE, (time.time() + delay, next(_TASK_SEQUENCE), task))
+    _wake_dispatcher()
+
+
+def _wake_dispatcher():
+    '''
+    wake up dispatcher to check _TASK_QUEUE and _RETRY_QUEUE, _GLOBAL_TASK_LOCK must be held
+    '''
+    try:
+        _TASK_WAKEUP_SOCKET.send(b'', zmq.NOBLOCK)
+    except zmq.Again:
+        pass  # dispatcher has enough wakeups pending
+
+
+def _bind(socket, name):
+    '''
+    bind socket to _ENDPOINTS[name], and also to _REMOTE_ENDPOINTS[name] if boss accepts remote workers
+    '''
+    socket.bind(_ENDPOINTS[name])
+    if name in _REMOTE_ENDPOINTS:
+        socket.bind(_REMOTE_ENDPOINTS[name])
+
+
+def _unbind(socket, name):
+    '''
+    unbind socket from the endpoints of _bind(socket, name)
+    closing a socket releases its endpoints later in background, unbinding does at once,
+    so next start() can bind them again
+    '''
+    for endpoints in (_ENDPOINTS, _REMOTE_ENDPOINTS):
+        if name in endpoints:
+            try:
+                socket.unbind(endpoints[name])
+            except zmq.ZMQError:
+                pass  # e.g. tcp://*:port is bound as the resolved address
+
+
+def _drain(socket):
+    '''
+    receive and discard all pending messages of socket
+    '''
+    while True:
+        try:
+            socket.recv(zmq.NOBLOCK)
+        except zmq.Again:
+            break
+
+
+def _send_command(endpoint, command):
+    '''
+    send command to the command socket of a worker
+    @param endpoint Endpoint the worker's command socket binds to
+    @param command e.g. b'STOP'
+    '''
+    command_out = _CONTEXT.socket(zmq.PUSH)
+    command_out.connect(endpoint)
+    command_out.send(command)
+    command_out.close(linger=_LINGER)
+
+
+def _make_endpoints(mode):
+    '''
+    @param mode 'thread' or 'process'
+    @return dict of endpoints, inproc:// for worker threads, ipc:// for worker processes
+    '''
+    if 'process' == mode:
+        prefix = 'ipc://{tmp}/boss-{pid}-'.format(tmp=tempfile.gettempdir(), pid=os.getpid())
+    else:
+        prefix = 'inproc://'
+    return {
+        'task': prefix + _WORKER_TASK,
+        'result': prefix + _WORKER_RESULT,
+        'ack': prefix + _WORKER_ACK,
+        'command': prefix + _WORKER_COMMAND,
+    }
+
+
+def _make_tcp_endpoints(address):
+    '''
+    @param address tcp://host:port, task endpoint of boss
+    @return dict of tcp:// endpoints, result and ack endpoints are on the next two ports
+    '''
+    host, port = address.rsplit(':', 1)
+    port = int(port)
+    return {
+        'task': '{host}:{port}'.format(host=host, port=port),
+        'result': '{host}:{port}'.format(host=host, port=port + 1),
+        'ack': '{host}:{port}'.format(host=host, port=port + 2),
+    }
 
 
 def _sync_workers(ack_in, num_workers):
     '''
     synchronise active workers
-    @param ack_in worker thread ack in socket, binds to inproc://_WORKER_ACK
+    @param ack_in worker ack in socket, binds to _ENDPOINTS['ack']
     @param num_workers Number of workers
     '''
     num_active_workers = 0
@@ -216,23 +1039,62 @@ def _sync_workers(ack_in, num_workers):
         num_active_workers += 1
 
 
-def start(action, num_workers=3):
+def start(action, num_workers=3, mode='thread', bind=None, retry_policy=None, autoscale=None, max_finished_tasks=_MAX_FINISHED_TASKS, journal=None):
     '''
     @param action bool(Task)
     @num_workers Number workers, default 3
+    @param mode 'thread' (default) for worker threads, or 'process' for worker processes,
+                which need action to be a module level function
+    @param bind tcp://interface:port to accept remote workers on, e.g. tcp://*:5555, default None
+                task, result and ack sockets bind to port, port + 1 and port + 2
+    @param retry_policy RetryPolicy of failed Tasks, default None, i.e. no retry
+    @param autoscale AutoscalePolicy to start and retire local workers at runtime, from num_workers,
+                     default None, i.e. num_workers for the whole run
+    @param max_finished_tasks Number of finished Tasks kept for dedup and tasks(), the oldest are evicted beyond,
+                              so memory stays flat over long runs, None to keep all, default 100000
+    @param journal journal.Journal to record the final state of each Task in, default None
     '''
+    if mode not in _MODES:
+        raise ValueError('Unknown boss mode: {mode}'.format(mode=mode))
+
+    global _ENDPOINTS
+    _ENDPOINTS = _make_endpoints(mode)
+
+    global _REMOTE_ENDPOINTS
+    _REMOTE_ENDPOINTS = _make_tcp_endpoints(bind) if bind else {}
+
+    global _RETRY_POLICY
+    _RETRY_POLICY = retry_policy or RetryPolicy()
+
     global _WORKING_THREADS
     _WORKING_THREADS = []
 
-    global _TASKS
+    global _TASKS, _MAX_FINISHED
     _TASKS = {}
+    _FINISHED_TASKS.clear()
+    _MAX_FINISHED = max_finished_tasks
+    _TASK_COUNTS.update(pending=0, done=0, failed=0)
+    _TASK_TIMES.update(finished=0, seconds=0.0)
+
+    global _SCALER
+    _SCALER = None
+
+    global _JOURNAL
+    _JOURNAL = journal
 
-    global _TASK_OUT_SOCKET
-    _TASK_OUT_SOCKET = None
+    del _TASK_QUEUE[:]
+    del _RETRY_QUEUE[:]
+
+    global _TASK_WAKEUP_SOCKET
+    _TASK_WAKEUP_SOCKET = None
 
     # bind worker ack
     ack_in = _CONTEXT.socket(zmq.REP)
-    ack_in.bind('inproc://{proc_name}'.format(proc_name=_WORKER_ACK))
+    _bind(ack_in, 'ack')
+
+    # create dispatcher, it starts after local workers are synced
+    dispatcher_thread = _DispatcherThread(ack_in)
+    _WORKING_THREADS.append(dispatcher_thread)
 
     # create sink
     sinker_thread = _SinkerThread()
@@ -241,18 +1103,20 @@ def start(action, num_workers=3):
 
     # create workers
     logger.debug('create workers')
-    for i in range(num_workers):
-        worker_thread = _WorkerThread(action=action)
-        _WORKING_THREADS.append(worker_thread)
-        worker_thread.start()
+    workers = [_start_worker(action, mode) for i in range(num_workers)]
 
     try:
         logger.debug('sync workers')
         _sync_workers(ack_in, num_workers)
+        dispatcher_thread.start()
 
-        # create _TASK_OUT_SOCKET
-        _TASK_OUT_SOCKET = _CONTEXT.socket(zmq.PUSH)
-        _TASK_OUT_SOCKET.bind('inproc://{proc_name}'.format(proc_name=_WORKER_TASK))
+        # create _TASK_WAKEUP_SOCKET
+        _TASK_WAKEUP_SOCKET = _CONTEXT.socket(zmq.PUSH)
+        _TASK_WAKEUP_SOCKET.connect(_WORKER_WAKEUP)
+
+        if autoscale:
+            _SCALER = _ScalerThread(autoscale, action, mode, workers)
+            _SCALER.start()
     except Exception as e:
         logger.error('Error in start worker')
         logger.exception(e)
@@ -261,34 +1125,69 @@ def start(action, num_workers=3):
 
 def stop():
     '''
-    stop all working threads, including workers and sinker
+    stop all working threads and processes, including workers and sinker
     '''
-    for t in _WORKING_THREADS:
+    # stop scaler first, so no worker is started meanwhile
+    if _SCALER and _SCALER.is_alive():
+        _SCALER.stop()
+        _SCALER.join()
+
+    # stop workers first, so their last results still reach the sinker
+    for t in reversed(_WORKING_THREADS):
+        if not t.is_alive():
+            continue
         logger.debug('Stopping thread {id}'.format(id=t.id))
         t.stop()
         t.join()
 
+    # assign_task() sends wakeups with _GLOBAL_TASK_LOCK held
+    global _TASK_WAKEUP_SOCKET
+    _GLOBAL_TASK_LOCK.acquire()
+    if _TASK_WAKEUP_SOCKET:
+        _TASK_WAKEUP_SOCKET.close(linger=0)
+        _TASK_WAKEUP_SOCKET = None
+    _GLOBAL_TASK_LOCK.release()
+
 
 def assign_task(task):
     '''
     Assign task to the active worker
     @param task Task object
     '''
-    global _TASK_OUT_SOCKET
-    global _TASKS
-    if not _TASK_OUT_SOCKET:
-        logger.error('Error _TASK_OUT_SOCKET is None. start() the boss')
-        return
+    if assign_tasks([task]):
+        logger.debug('queue task: {task}'.format(task=task.id))
+    elif _TASK_WAKEUP_SOCKET:
+        logger.debug('task: {task_id} is processed'.format(task_id=task.id))
+
+
+def assign_tasks(tasks):
+    '''
+    Assign a batch of tasks, e.g. all segments of a playlist, under one lock and with one wakeup of the dispatcher
+    tasks already assigned, including duplicates within the batch, are skipped as assign_task() does
+    @param tasks Iterable of Task objects
+    @return Number of tasks queued
+    '''
+    if not _TASK_WAKEUP_SOCKET:
+        logger.error('Error _TASK_WAKEUP_SOCKET is None. start() the boss')
+        return 0
 
+    # consume tasks before locking, they may be generated lazily
+    tasks = list(tasks)
+    new_tasks = []
     _GLOBAL_TASK_LOCK.acquire()
-    if task.id in _TASKS:
-        logger.debug('task: {task_id} is processed'.format(task_id=task.id))
-        _GLOBAL_TASK_LOCK.release()
-    else:
+    for task in tasks:
+        if task.id in _TASKS:
+            continue
         _TASKS[task.id] = task
-        _GLOBAL_TASK_LOCK.release()
-        logger.debug('send task: {task}'.format(task=task.id))
-        _TASK_OUT_SOCKET.send_json(task.__dict__)
+        _TASK_COUNTS[task.state()] += 1
+        new_tasks.append(task)
+    if new_tasks:
+        _queue_tasks(new_tasks)
+        _wake_dispatcher()
+    _GLOBAL_TASK_LOCK.release()
+    if len(tasks) > 1:
+        logger.debug('queue {n} of {m} tasks'.format(n=len(new_tasks), m=len(tasks)))
+    return len(new_tasks)
 
 
 def have_all_tasks_done():
@@ -296,26 +1195,112 @@ def have_all_tasks_done():
     Check whether all tasks done
     @return True if all tasks done
     '''
-    _GLOBAL_TASK_LOCK.acquire()
-    tasks = _TASKS.values()
-    num_done = len([x for x in tasks if x.is_done()])
-    num_failed = len([x for x in tasks if x.is_failed()])
-    num_pending = len(tasks) - num_done - num_failed
-    progress_message = '**** [boss] {num_done}/{num_total} DONE {num_failed} Failed **** \r'.format(num_done=num_done, num_total=len(tasks), num_failed=num_failed)
+    task_stats = stats()
+    progress_message = '**** [boss] {done}/{total} DONE {failed} Failed **** \r'.format(**task_stats)
     sys.stdout.write(progress_message)
     sys.stdout.flush()
-    all_TASKS_done = (num_pending == 0)
+    return 0 == task_stats['pending']
+
+
+def wait_all(timeout=None):
+    '''
+    Block until all assigned tasks are done or failed
+    @param timeout Max seconds to wait, None to wait until all tasks done
+    @return True if all tasks done, False if timeout
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+    _ALL_TASKS_DONE.acquire()
+    try:
+        while _TASK_COUNTS['pending']:
+            if deadline is None:
+                _ALL_TASKS_DONE.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                _ALL_TASKS_DONE.wait(remaining)
+        return True
+    finally:
+        _ALL_TASKS_DONE.release()
+
+
+def stats():
+    '''
+    @return dict of number of tasks, keys: 'pending', 'done', 'failed' and 'total'
+    '''
+    _GLOBAL_TASK_LOCK.acquire()
+    task_stats = dict(_TASK_COUNTS)
     _GLOBAL_TASK_LOCK.release()
-    return all_TASKS_done
+    task_stats['total'] = task_stats['pending'] + task_stats['done'] + task_stats['failed']
+    return task_stats
 
 
 def tasks():
     '''
-    @return array of assigned Task instances
+    @return dict of pending Tasks and summaries of the latest finished Tasks, key: Task.id
     '''
     return _TASKS
 
 
+def _import_action(name):
+    '''
+    @param name module.function, e.g. streambot._download_task_action
+    @return the function
+    '''
+    import importlib
+    module_name, function_name = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_worker(action, connect, num_workers=1, credit=_WORKER_CREDIT):
+    '''
+    Run worker threads for a remote boss, until the process is killed
+    Task commands are run on this host, e.g. local paths of download tasks are relative to this host
+
+    @param action bool(Task)
+    @param connect tcp://host:port, the bind address of the boss
+    @param num_workers Number of worker threads, default 1
+    @param credit Number of Tasks each worker holds at a time, more than 1 hides network latency, default 1
+    '''
+    context = zmq.Context()
+    endpoints = _make_tcp_endpoints(connect)
+    endpoints['command'] = 'inproc://' + _WORKER_COMMAND
+    workers = [_WorkerThread(action, context, endpoints, heartbeat=True, credit=credit) for i in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    logger.debug('{n} workers connect to {connect}'.format(n=num_workers, connect=connect))
+    for worker in workers:
+        worker.join()
+
+
+def _parse_argument():
+    import argparse
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('example', help='Run boss example')
+    benchmark_parser = subparsers.add_parser('benchmark', help='Measure per Task overhead of boss with the previous and the current wire format')
+    benchmark_parser.add_argument('--num_tasks', '-n', type=int, default=100000, help='Number of no-op tasks. Default is 100000')
+    worker_parser = subparsers.add_parser('worker', help='Run workers for a remote boss')
+    worker_parser.add_argument('--connect', '-c', required=True, help='Boss address, e.g. tcp://host:5555')
+    worker_parser.add_argument('--action', '-a', default='streambot._download_task_action', help='Task action, module.function. Default is streambot._download_task_action')
+    worker_parser.add_argument('--num_workers', '-n', type=int, default=1, help='Number of worker threads. Default is 1')
+    worker_parser.add_argument('--credit', type=int, default=_WORKER_CREDIT, help='Number of tasks each worker holds at a time. Default is 1')
+    worker_parser.add_argument('--verbose', '-v', help="increase output verbosity", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_argument()
+    if 'worker' == args.command:
+        if args.verbose:
+            logging.basicConfig(level=logging.DEBUG)
+        run_worker(_import_action(args.action), args.connect, args.num_workers, args.credit)
+    elif 'benchmark' == args.command:
+        _benchmark(args.num_tasks)
+    else:
+        _example()
+
+
 def _example():
     # setup logger
     logging.basicConfig(level=logging.DEBUG)
@@ -326,7 +1311,6 @@ def _example():
         @return True indicating task done, False otherwise
         '''
         logger.debug('procesing task: {id}'.format(id=task.id))
-        import random
         time.sleep(random.randint(1, 10))
         return True
 
@@ -335,20 +1319,14 @@ def _example():
 
     # dispatch dummy tasks
     for i in range(5):
-        import random
         task_id = random.randint(1, 30)
         task = Task(task_id, {})
         assign_task(task)
         time.sleep(0.5)
 
     # check all tasks done before stop boss
-    total_check = 0
-    while not have_all_tasks_done():
-        logger.debug('Waiting for all _TASKS done')
-        time.sleep(1)
-        total_check += 1
-        if total_check > 50:
-            break
+    logger.debug('Waiting for all _TASKS done')
+    wait_all(timeout=50)
 
     # stop boss (including worker and sinker processes)
     stop()
@@ -357,5 +1335,70 @@ def _example():
     logger.debug(all_tasks)
 
 
+def _no_op_action(task):
+    return True
+
+
+def _task_to_dict_msg(task):
+    '''
+    Task wire encoding before _task_to_msg(), JSON of a dict of Task attributes, kept for _benchmark() only
+    '''
+    return json.dumps(dict((k, getattr(task, k)) for k in Task.__slots__)).encode('utf-8')
+
+
+def _task_from_dict_msg(task_msg):
+    task_dict = json.loads(task_msg.decode('utf-8'))
+    task = Task(task_dict['id'], task_dict['command'], task_dict['status'], task_dict['priority'], task_dict['deadline'])
+    task.attempts = task_dict['attempts']
+    task.retryable = task_dict['retryable']
+    return task
+
+
+_WIRE_FORMATS = [
+    ('dict', _task_to_dict_msg, _task_from_dict_msg),  # JSON of a dict of Task attributes, the previous encoding
+    ('array', _task_to_msg, _task_from_msg),  # compact JSON array of Task.__slots__ values, the current encoding
+]
+
+
+def _benchmark(num_tasks):
+    '''
+    print per Task overhead of each wire format side by side:
+    wire bytes, encoding and decoding time, and no-op Tasks per second through boss
+    '''
+    global _task_to_msg, _task_from_msg
+    command = {'uri': 'http://host.com/path/to/segment_000123456.ts', 'local': 'output/path/to/segment_000123456.ts',
+               'clear_local': False, 'chunk_size': 65536}
+    current = (_task_to_msg, _task_from_msg)
+    for name, to_msg, from_msg in _WIRE_FORMATS:
+        all_tasks = [Task(i, dict(command)) for i in range(num_tasks)]
+
+        begin = time.time()
+        msgs = [to_msg(task) for task in all_tasks]
+        encode_time = time.time() - begin
+        begin = time.time()
+        for msg in msgs:
+            from_msg(msg)
+        decode_time = time.time() - begin
+
+        # dispatcher and workers run in threads of this process, and look up the encoding at call time
+        _task_to_msg, _task_from_msg = to_msg, from_msg
+        try:
+            start(action=_no_op_action)
+            begin = time.time()
+            for task in all_tasks:
+                assign_task(task)
+            wait_all()
+            elapsed = time.time() - begin
+            stop()
+        finally:
+            _task_to_msg, _task_from_msg = current
+
+        print('{name:5}: {n:.0f} bytes per Task message, encode {e:.2f} us, decode {d:.2f} us, {t} no-op Tasks per second'.format(
+              name=name, n=sum(len(msg) for msg in msgs) / float(num_tasks), e=encode_time / num_tasks * 1e6,
+              d=decode_time / num_tasks * 1e6, t=int(num_tasks / elapsed)))
+
+
 if __name__ == '__main__':
-    _example()
+    main()
+
+# python boss.py worker --connect tcp://boss.host:5555 -n 4
@@ -0,0 +1,211 @@
+'''
+cache.py
+
+Content addressed cache of downloaded segments, shared by clones of the same origins into different output dirs
+each content is stored once as a blob named by its SHA-256, an index maps URIs to blobs,
+and cached content is hard linked into output trees, or copied where hard links are not supported
+
+segments are assumed immutable, i.e. a URI is not downloaded again once its content is cached
+least recently used blobs are removed once the cache grows over its size budget
+the index is saved every 100 changes, so a killed clone loses only its latest entries,
+blobs no index entry refers to are evicted first
+
+Interfaces:
+    SegmentCache(directory, max_bytes=10GB)
+        get(uri, local):
+        put(uri, local):
+        save():
+'''
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger('cache.streambot')
+
+_MAX_BYTES = 10 * 1024 * 1024 * 1024  # size budget of blobs
+_LOW_WATER = 0.9  # eviction goes down to this fraction of the size budget, so it does not run on every put
+_INDEX_FILE = 'index.json'
+_BLOB_DIR = 'blobs'
+_HASH_CHUNK_SIZE = 1024 * 1024  # bytes read at a time while hashing
+_SAVE_INTERVAL = 100  # index is saved once this many blobs are added or evicted
+
+
+def _hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _link_or_copy(source, target):
+    '''
+    hard link target to source, copy where hard links are not supported, e.g. across file systems
+    '''
+    try:
+        os.link(source, target)
+    except (OSError, AttributeError):
+        # AttributeError: os.link is not available on Windows with Python 2
+        shutil.copyfile(source, target)
+
+
+class SegmentCache(object):
+    def __init__(self, directory, max_bytes=_MAX_BYTES):
+        '''
+        @param directory Cache directory, created if it does not exist
+        @param max_bytes Size budget of cached content, default 10GB
+        '''
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(directory, _BLOB_DIR)
+        self.index_path = os.path.join(directory, _INDEX_FILE)
+        self.lock = threading.Lock()
+        self.index = self._load_index()  # key: URI, value: SHA-256 of content
+        self.blobs = collections.OrderedDict()  # key: SHA-256, value: size, least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.changes = 0  # blobs added or evicted since the index was saved
+
+        if not os.path.isdir(self.blob_dir):
+            os.makedirs(self.blob_dir)
+        blobs = []
+        for subfolder, _, files in os.walk(self.blob_dir):
+            for name in files:
+                st = os.stat(os.path.join(subfolder, name))
+                blobs.append((st.st_mtime, name, st.st_size))
+        # blobs are touched on use, so modification time orders them by last use,
+        # blobs left without an index entry, e.g. by a killed process, can not be used and go first
+        indexed = set(self.index.values())
+        for _, digest, size in sorted(blobs, key=lambda b: (b[1] in indexed, b[0])):
+            self.blobs[digest] = size
+            self.total_bytes += size
+        logger.debug('open cache {directory}: {n} blobs, {size} bytes'.format(directory=directory, n=len(self.blobs), size=self.total_bytes))
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def get(self, uri, local):
+        '''
+        Link cached content of uri to local
+        @param uri URI of the content
+        @param local path/to/target.file, its folder must exist
+        @return True if uri is cached and linked to local, False if not cached
+        '''
+        self.lock.acquire()
+        digest = self.index.get(uri)
+        if digest not in self.blobs:
+            if digest:
+                # the blob is evicted, possibly by another process sharing the cache
+                del self.index[uri]
+            self.misses += 1
+            self.lock.release()
+            return False
+        self.blobs[digest] = self.blobs.pop(digest)
+        self.hits += 1
+        self.lock.release()
+
+        blob = self._blob_path(digest)
+        try:
+            os.utime(blob, None)
+            if os.path.exists(local):
+                os.remove(local)
+            _link_or_copy(blob, local)
+        except (IOError, OSError) as e:
+            logger.error('Failed link {blob} to {local}: {error}'.format(blob=blob, local=local, error=e))
+            self.lock.acquire()
+            self.total_bytes -= self.blobs.pop(digest, 0)
+            self.lock.release()
+            return False
+        logger.debug('{uri} is linked from cache to {local}'.format(uri=uri, local=local))
+        return True
+
+    def put(self, uri, local):
+        '''
+        Add downloaded content of uri to the cache, content already cached under another URI is stored once
+        @param uri URI of the content
+        @param local path/to/downloaded.file
+        '''
+        try:
+            digest = _hash_file(local)
+            blob = self._blob_path(digest)
+            if not os.path.exists(blob):
+                subfolder = os.path.dirname(blob)
+                if not os.path.isdir(subfolder):
+                    try:
+                        os.makedirs(subfolder)
+                    except OSError:
+                        if not os.path.isdir(subfolder):
+                            raise
+                # link or copy to a temporary name, so other processes never see a partial blob
+                temporary = '{blob}.{pid}.{thread}'.format(blob=blob, pid=os.getpid(), thread=threading.current_thread().ident)
+                _link_or_copy(local, temporary)
+                os.rename(temporary, blob)
+            size = os.path.getsize(blob)
+        except (IOError, OSError) as e:
+            logger.error('Failed cache {local}: {error}'.format(local=local, error=e))
+            return
+
+        self.lock.acquire()
+        self.index[uri] = digest
+        if digest in self.blobs:
+            self.blobs[digest] = self.blobs.pop(digest)
+        else:
+            self.blobs[digest] = size
+            self.total_bytes += size
+            self.changes += 1
+        if self.total_bytes > self.max_bytes:
+            self._evict(int(self.max_bytes * _LOW_WATER))
+        save = self.changes >= _SAVE_INTERVAL
+        self.lock.release()
+
+        if save:
+            self.save()
+
+    def _evict(self, target_bytes):
+        '''
+        remove least recently used blobs until total_bytes is no more than target_bytes
+        _evict() is called with self.lock acquired
+        '''
+        evicted = 0
+        while self.blobs and self.total_bytes > target_bytes:
+            digest, size = self.blobs.popitem(last=False)
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+            self.total_bytes -= size
+            evicted += 1
+        self.changes += evicted
+        logger.debug('{n} blobs evicted from cache, {size} bytes left'.format(n=evicted, size=self.total_bytes))
+
+    def save(self):
+        '''
+        Write the URI index to the cache directory, merged with the index saved by other processes meanwhile
+        '''
+        self.lock.acquire()
+        index = self._load_index()
+        index.update(self.index)
+        index = dict((uri, digest) for uri, digest in index.items() if os.path.exists(self._blob_path(digest)))
+        self.index = index
+        self.changes = 0
+        self.lock.release()
+
+        temporary = '{path}.{pid}.{thread}'.format(path=self.index_path, pid=os.getpid(), thread=threading.current_thread().ident)
+        with open(temporary, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        if os.path.exists(self.index_path) and 'nt' == os.name:
+            os.remove(self.index_path)
+        os.rename(temporary, self.index_path)
+        logger.debug('cache index saved: {n} URIs, {hits} hits, {misses} misses'.format(n=len(index), hits=self.hits, misses=self.misses))
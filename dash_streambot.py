@@ -3,31 +3,138 @@
 '''
 dash_streambot.py
 '''
-import boss
-import urlparse
+try:
+    import urlparse
+except ImportError:
+    # Python 3, for the asyncio engine
+    import urllib.parse as urlparse
+import calendar
 import logging
-import os
+import math
+import re
 import time
-import sys
 from mpegdash.parser import MPEGDASHParser
-import mpegdash
 
 import streambot
 
 logger = logging.getLogger('streambot.dash_streambot')
 
 
-def _make_segment_url(mpd_base_url, period_base_url, adaptation_set_base_url, representation_base_url):
-    mpd_base_url_value = mpd_base_url.base_url_value if mpd_base_url else ''
-    period_base_url_value = period_base_url.base_url_value if period_base_url else ''
-    adaptation_set_base_url_value = adaptation_set_base_url.base_url_value if adaptation_set_base_url else ''
-    representation_base_url_value = representation_base_url.base_url_value if representation_base_url else ''
+_DURATION_PATTERN = re.compile(r'^P(?:(?P<days>[\d.]+)D)?(?:T(?:(?P<hours>[\d.]+)H)?(?:(?P<minutes>[\d.]+)M)?(?:(?P<seconds>[\d.]+)S)?)?$')
+_TEMPLATE_IDENTIFIER = re.compile(r'\$(?:(RepresentationID|Number|Bandwidth|Time)(%0\d+d)?)?\$')  # $$ is an escaped $
+_DATETIME_PATTERN = re.compile(r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d(?:\.\d+)?)(Z|[+-]\d\d:\d\d)?$')
+_LIVE_INTERVAL = 2  # seconds between checks of a LIVE MPD without maxSegmentDuration
 
-    if streambot.is_full_uri(representation_base_url_value):
-        return representation_base_url_value
 
-    url = ''.join([mpd_base_url_value, period_base_url_value, adaptation_set_base_url_value, representation_base_url_value])
-    return url
+def _parse_duration(value):
+    '''
+    Parse xs:duration of MPD, e.g. PT1H2M3.5S
+    @param value Duration string, or None
+    @return Seconds as float, None if value is None or not a duration
+    '''
+    if not value:
+        return None
+    match = _DURATION_PATTERN.match(value.strip())
+    if not match:
+        logger.error('Invalid duration: {value}'.format(value=value))
+        return None
+    parts = match.groupdict()
+    return (float(parts['days'] or 0) * 86400 + float(parts['hours'] or 0) * 3600 +
+            float(parts['minutes'] or 0) * 60 + float(parts['seconds'] or 0))
+
+
+def _parse_datetime(value):
+    '''
+    Parse xs:dateTime of MPD, e.g. 2020-01-01T00:00:00Z, a time without zone is taken as UTC
+    @param value Date time string, or None
+    @return Seconds since epoch as float, None if value is None or not a date time
+    '''
+    if not value:
+        return None
+    match = _DATETIME_PATTERN.match(value.strip())
+    if not match:
+        logger.error('Invalid date time: {value}'.format(value=value))
+        return None
+    year, month, day, hour, minute = [int(g) for g in match.groups()[:5]]
+    seconds = calendar.timegm((year, month, day, hour, minute, 0)) + float(match.group(6))
+    zone = match.group(7)
+    if zone and 'Z' != zone:
+        offset = int(zone[1:3]) * 3600 + int(zone[4:6]) * 60
+        seconds += -offset if '+' == zone[0] else offset
+    return seconds
+
+
+def _expand_template(template, representation_id=None, number=None, bandwidth=None, time=None):
+    '''
+    Substitute identifiers of a SegmentTemplate media or initialization attribute
+    $Number$, $Bandwidth$ and $Time$ may carry a width format tag, e.g. $Number%05d$, and $$ is a literal $
+    @param template Value of the media or initialization attribute
+    @return Expanded URL
+    '''
+    values = {'RepresentationID': representation_id, 'Number': number, 'Bandwidth': bandwidth, 'Time': time}
+
+    def substitute(match):
+        identifier, format_tag = match.groups()
+        if not identifier:
+            return '$'
+        if format_tag and 'RepresentationID' != identifier:
+            return format_tag % values[identifier]
+        return str(values[identifier])
+
+    return _TEMPLATE_IDENTIFIER.sub(substitute, template)
+
+
+def _parse_byterange(value):
+    '''
+    @param value Byte range of mediaRange, indexRange or range attribute, e.g. 100-199
+    @return (first, last), None if value is None or open-ended
+    '''
+    first, _, last = (value or '').partition('-')
+    if not first or not last:
+        return None
+    return int(first), int(last)
+
+
+def _first(nodes):
+    return nodes[0] if nodes else None
+
+
+def _inherit(name, *nodes):
+    '''
+    @param name Attribute name
+    @param nodes Segment information of representation, adaptation set and period, the most specific first, or None
+    @return Value of the attribute on the most specific node having it, None if no node has it
+    '''
+    for node in nodes:
+        value = getattr(node, name, None) if node is not None else None
+        if value is not None and [] != value:
+            return value
+    return None
+
+
+def _timeline(segment_timeline, start_number, end_time=None):
+    '''
+    Expand S elements of a SegmentTimeline
+    @param segment_timeline SegmentTimeline node
+    @param start_number Number of the first segment
+    @param end_time End of the period in timescale units, to expand a repeat count of -1 of the last S, default None
+    @return Generator of (number, time, duration) of segments
+    '''
+    timeline = segment_timeline.Ss or []
+    number = start_number
+    time = 0
+    for i, s in enumerate(timeline):
+        if s.t is not None:
+            time = s.t
+        repeat = s.r or 0
+        if repeat < 0:
+            # repeat until the next S, or the end of the period
+            next_time = timeline[i + 1].t if i + 1 < len(timeline) else end_time
+            repeat = int(math.ceil((next_time - time) / float(s.d))) - 1 if next_time is not None else 0
+        for _ in range(repeat + 1):
+            yield number, time, s.d
+            number += 1
+            time += s.d
 
 
 def _check_is_byterange(mpd_base_url, period_base_url, adaptation_set_base_url, representation_base_url):
@@ -38,17 +145,24 @@ def _check_is_byterange(mpd_base_url, period_base_url, adaptation_set_base_url,
     return mpd_is_byterange or period_is_byterange or adaptation_set_is_byterange or representation_is_byterange
 
 
-class DASHSegment():
-    def __init__(self, uri, is_byterange=False):
+class DASHSegment(object):
+    __slots__ = ('uri', 'is_byterange', 'byterange', 'end')
+
+    def __init__(self, uri, is_byterange=False, byterange=None, end=None):
         '''
         @param uri Absolute URI of segment
         @param is_byterange Default False
+        @param byterange (first, last) byte offsets of the segment in uri, default None
+        @param end Seconds since availabilityStartTime the segment ends, i.e. becomes available in a LIVE MPD,
+                   default None if unknown, e.g. initialization segments
         '''
         if not streambot.is_full_uri(uri):
             raise streambot.StreamBotError('DASHSegment URI is not absolute: {uri}'.format(uri=uri))
 
         self.uri = uri
         self.is_byterange = is_byterange
+        self.byterange = byterange
+        self.end = end
 
     def log(self):
         logger.debug('Segment URI: {uri}'.format(uri=self.uri))
@@ -64,13 +178,19 @@ class MPD():
 
         self.uri = mpd_uri
         self.mpd = None
+        self.changed = True  # False if the last download_and_save() got an MPD not modified
 
     def download_and_save(self, output_dir=streambot._OUTPUT_DIR):
         '''
         download and save playlist
         also parse media playlists
+        an MPD not modified since the last download is neither downloaded nor parsed again
         '''
-        self.local = streambot.download_and_save_to(self.uri, output_dir, True)
+        self.local, modified = streambot.refresh_and_save_to(self.uri, output_dir)
+        self.changed = modified or not self.mpd
+        if not self.changed:
+            logger.debug('MPD {uri} is not modified'.format(uri=self.uri))
+            return
         logger.debug('stream playlist is saved as: {local}'.format(local=self.local))
 
         with open(self.local, 'r') as f:
@@ -78,44 +198,203 @@ class MPD():
             self.mpd = MPEGDASHParser.parse(content)
 
     def is_live(self):
-        return 'static' != self.mpd.type
+        # type is static unless the MPD says dynamic
+        return 'dynamic' == self.mpd.type
 
     def parse_segments(self):
         '''
-        Parse segment URLs from MPD
+        Parse segments from MPD
+        @return List of DASHSegment, see iter_segments()
+        '''
+        return list(self.iter_segments())
 
-        Support Single Segment URL, Segment timeline, and Segment template
-        @return List of segment URLs
+    def iter_segments(self, window=None):
         '''
-        mpd_base_url = self.mpd.base_urls[0] if self.mpd.base_urls else None
-        segments = []
-        for period in self.mpd.periods:
-            period_base_url = period.base_urls[0] if period.base_urls else None
-            if period.segment_lists:
-                segments = self._get_segments_from_period_segment_list(period)
-            elif period.segment_templates:
-                segments = self._get_segments_from_period_segment_template(period)
-            else:
-                for adaptation_set in period.adaptation_sets:
-                    adaptation_set_base_url = adaptation_set.base_urls[0] if adaptation_set.base_urls else None
-                    if adaptation_set.segment_lists:
-                        segments = self._get_segments_from_adaptation_set_segment_list(period, adaptation_set)
-                    elif adaptation_set.segment_templates:
-                        segments = self._get_segments_from_adaptation_set_segment_template(period, adaptation_set)
-                    else:
-                        for representation in adaptation_set.representations:
-                            representation_base_url = representation.base_urls[0] if representation.base_urls else None
-                            if representation.segment_lists:
-                                segments = self._get_segments_from_representation_segment_list(period, adaptation_set, representation)
-                            elif representation.segment_templates:
-                                segments = self._get_segments_from_representation_segment_template(period, adaptation_set, representation)
-                            else:
-                                # case of single segment URL
-                                segment_url = _make_segment_url(mpd_base_url, period_base_url, adaptation_set_base_url, representation_base_url)
-                                is_byterange = _check_is_byterange(mpd_base_url, period_base_url, adaptation_set_base_url, representation_base_url)
-                                segments.append(DASHSegment(segment_url, is_byterange))
-
-        return segments
+        Generate segments of every representation of every period lazily
+
+        Support Single Segment URL, SegmentList, SegmentTemplate with $Number$ or SegmentTimeline,
+        segment information is inherited from adaptation set and period
+        @param window (start, end) seconds since availabilityStartTime, only media segments ending after start
+                      and no later than end are generated, end None for no bound, default None for all segments
+        @return Generator of DASHSegment
+        '''
+        period_start = 0
+        for i, period in enumerate(self.mpd.periods or []):
+            period_start = _parse_duration(period.start) if period.start else period_start
+            period_duration = self._period_duration(i)
+            period_window = None
+            if window:
+                start, end = window
+                period_window = (start - period_start, None if end is None else end - period_start)
+            for adaptation_set in period.adaptation_sets or []:
+                for representation in adaptation_set.representations or []:
+                    for s in self._representation_segments(period, adaptation_set, representation, period_duration, period_window):
+                        if s.end is not None:
+                            s.end += period_start
+                        yield s
+            if period_duration is not None:
+                period_start += period_duration
+
+    def availability_start(self):
+        '''
+        @return availabilityStartTime in seconds since epoch, 0 if the MPD has none
+        '''
+        return _parse_datetime(self.mpd.availability_start_time) or 0
+
+    def update_period(self):
+        '''
+        @return minimumUpdatePeriod in seconds, None if the MPD does not change
+        '''
+        return _parse_duration(self.mpd.minimum_update_period)
+
+    def presentation_delay(self):
+        '''
+        @return Seconds behind the LIVE edge to start from, suggestedPresentationDelay or minBufferTime,
+                no more than timeShiftBufferDepth
+        '''
+        delay = _parse_duration(self.mpd.suggested_presentation_delay)
+        if delay is None:
+            delay = _parse_duration(self.mpd.min_buffer_time) or 0
+        depth = _parse_duration(self.mpd.time_shift_buffer_depth)
+        return min(delay, depth) if depth is not None else delay
+
+    def buffer_depth(self):
+        '''
+        @return timeShiftBufferDepth in seconds, how long segments of a LIVE MPD stay available, None if unknown
+        '''
+        return _parse_duration(self.mpd.time_shift_buffer_depth)
+
+    def poll_interval(self):
+        '''
+        @return Seconds between checks of a LIVE MPD for new segments, maxSegmentDuration or 2 seconds,
+                the MPD is refetched at most once per check, so minimumUpdatePeriod of 0 means once per segment
+        '''
+        return _parse_duration(self.mpd.max_segment_duration) or _LIVE_INTERVAL
+
+    def _period_duration(self, index):
+        '''
+        @param index Index of the period
+        @return Duration of the period in seconds, None if unknown
+        '''
+        periods = self.mpd.periods
+        duration = _parse_duration(periods[index].duration)
+        if duration is not None:
+            return duration
+        if index + 1 < len(periods) and periods[index + 1].start:
+            end = _parse_duration(periods[index + 1].start)
+        else:
+            end = _parse_duration(self.mpd.media_presentation_duration)
+        if end is None:
+            return None
+        return end - (_parse_duration(periods[index].start) or 0)
+
+    def _base_url(self, *nodes):
+        '''
+        Resolve BaseURL of each node against the one of its parent, starting from the MPD URI
+        @param nodes Period, adaptation set and representation
+        @return Absolute base URL
+        '''
+        url = self.uri
+        for node in (self.mpd,) + nodes:
+            base_url = _first(node.base_urls)
+            if base_url and base_url.base_url_value:
+                url = urlparse.urljoin(url, base_url.base_url_value.strip())
+        return url
+
+    def _representation_segments(self, period, adaptation_set, representation, period_duration, window=None):
+        nodes = (representation, adaptation_set, period)
+        base_url = self._base_url(period, adaptation_set, representation)
+        segment_templates = [_first(n.segment_templates) for n in nodes if n.segment_templates]
+        if segment_templates:
+            return self._template_segments(base_url, segment_templates, representation, period_duration, window)
+        segment_lists = [_first(n.segment_lists) for n in nodes if n.segment_lists]
+        if segment_lists:
+            return self._list_segments(base_url, segment_lists)
+        if not representation.base_urls:
+            return []
+        # case of single segment URL
+        is_byterange = _check_is_byterange(*[_first(n.base_urls) for n in (self.mpd, period, adaptation_set, representation)])
+        return [DASHSegment(base_url, bool(is_byterange))]
+
+    def _list_segments(self, base_url, segment_lists):
+        '''
+        @param segment_lists SegmentList of representation, adaptation set and period, the most specific first
+        @return Generator of DASHSegment, the initialization segment first
+        '''
+        initialization = _first(_inherit('initializations', *segment_lists))
+        if initialization:
+            uri = urlparse.urljoin(base_url, initialization.source_url) if initialization.source_url else base_url
+            byterange = _parse_byterange(initialization.range)
+            if initialization.source_url or byterange:
+                yield DASHSegment(uri, bool(byterange), byterange)
+        for segment_url in _inherit('segment_urls', *segment_lists) or []:
+            uri = urlparse.urljoin(base_url, segment_url.media) if segment_url.media else base_url
+            index_range = _parse_byterange(segment_url.index_range)
+            if index_range:
+                index_uri = urlparse.urljoin(base_url, segment_url.index) if segment_url.index else uri
+                yield DASHSegment(index_uri, True, index_range)
+            byterange = _parse_byterange(segment_url.media_range)
+            yield DASHSegment(uri, bool(segment_url.media_range), byterange)
+
+    def _template_segments(self, base_url, segment_templates, representation, period_duration, window=None):
+        '''
+        @param segment_templates SegmentTemplate of representation, adaptation set and period, the most specific first
+        @param period_duration Seconds, to count segments of a template without SegmentTimeline
+        @param window (start, end) seconds since the period start, see iter_segments()
+        @return Generator of DASHSegment, the initialization segment first
+        '''
+        representation_id = representation.id
+        bandwidth = representation.bandwidth
+        initialization = _inherit('initialization', *segment_templates)
+        if not initialization:
+            initialization = _first(_inherit('initializations', *segment_templates))
+            initialization = initialization.source_url if initialization else None
+        if initialization:
+            uri = _expand_template(initialization, representation_id, bandwidth=bandwidth)
+            yield DASHSegment(urlparse.urljoin(base_url, uri))
+
+        media = _inherit('media', *segment_templates)
+        if not media:
+            return
+        timescale = float(_inherit('timescale', *segment_templates) or 1)
+        offset = _inherit('presentation_time_offset', *segment_templates) or 0
+        for number, media_time, duration in self._template_numbers(segment_templates, period_duration, window):
+            uri = _expand_template(media, representation_id, number, bandwidth, media_time)
+            yield DASHSegment(urlparse.urljoin(base_url, uri), end=(media_time + duration - offset) / timescale)
+
+    def _template_numbers(self, segment_templates, period_duration, window=None):
+        '''
+        @param window (start, end) seconds since the period start, see iter_segments()
+        @return Generator of ($Number$, $Time$, duration in timescale units) of the media segments of a SegmentTemplate
+        '''
+        timescale = float(_inherit('timescale', *segment_templates) or 1)
+        start_number = _inherit('start_number', *segment_templates)
+        start_number = 1 if start_number is None else start_number
+        offset = _inherit('presentation_time_offset', *segment_templates) or 0
+        start, end = window or (None, None)
+        if period_duration is not None:
+            end = period_duration if end is None else min(end, period_duration)
+
+        segment_timeline = _first(_inherit('segment_timelines', *segment_templates))
+        if segment_timeline:
+            end_time = offset + end * timescale if end is not None else None
+            segments = _timeline(segment_timeline, start_number, end_time)
+            if not window:
+                return segments
+            return ((number, t, d) for number, t, d in segments
+                    if start < (t + d - offset) / timescale and (end is None or (t + d - offset) / timescale <= end))
+
+        duration = _inherit('duration', *segment_templates)
+        if not duration or end is None:
+            logger.error('Can not count segments of MPD {uri} without duration'.format(uri=self.uri))
+            return iter([])
+        first = max(0, int(math.floor(start * timescale / duration))) if start is not None else 0
+        if window and window[1] is not None:
+            # only segments which have ended are available
+            last = int(math.floor(end * timescale / duration))
+        else:
+            last = int(math.ceil(end * timescale / duration))
+        return ((start_number + i, offset + i * duration, duration) for i in range(first, last))
 
 
 class DASHStreamBot(streambot.Bot):
@@ -133,39 +412,92 @@ class DASHStreamBot(streambot.Bot):
 
     def run(self):
         try:
-            boss.start(num_workers=self.num_worker, action=streambot._download_task_action)
+            self._start_engine()
             self._get_mpd()
             if self.mpd.is_live():
                 self._get_live_segments()
             else:
                 self._get_segments()
 
-            while not boss.have_all_tasks_done():
-                time.sleep(1)
+            self.task_engine.wait_all()
 
         except Exception as e:
             logger.exception(e)
         finally:
-            boss.stop()
+            self._stop_engine()
             self._report()
 
     def _get_mpd(self):
-        self.mpd.download_and_save()
+        self.mpd.download_and_save(self.output_dir)
 
     def _get_live_segments(self):
-        pass
+        '''
+        Queue segments of a LIVE MPD as they become available by wall clock, see MPD.poll_interval(),
+        until total_length seconds or the MPD turns static
+        capture starts MPD.presentation_delay() behind the LIVE edge
+        the MPD is refetched only after minimumUpdatePeriod, an MPD without it does not change,
+        with minimumUpdatePeriod of 0 it is refetched on every check
+        '''
+        start = time.time()
+        fetched = start
+        queued_until = start - self.mpd.availability_start() - self.mpd.presentation_delay()
+        while True:
+            now = time.time()
+            update_period = self.mpd.update_period()
+            if update_period is not None and now - fetched >= update_period:
+                fetched = now
+                try:
+                    self._get_mpd()
+                except streambot.StreamBotError as e:
+                    logger.error('Failed refresh MPD, keep the last one: {error}'.format(error=e))
+
+            if not self.mpd.is_live():
+                logger.debug('MPD {uri} turns static'.format(uri=self.mpd.uri))
+                self._queue_segments((queued_until, None))
+                return
+
+            live_edge = now - self.mpd.availability_start()
+            self._queue_segments((queued_until, live_edge))
+            queued_until = live_edge
+            if now - start >= self.total_length:
+                return
+            time.sleep(min(self.mpd.poll_interval(), max(0, start + self.total_length - now)))
 
     def _get_segments(self):
-        segments = self.mpd.parse_segments()
-        logger.debug('Download {n} segments from mpd {uri}'.format(n=len(segments), uri=self.mpd.uri))
-        for s in segments:
-            task = streambot.create_download_task(s.uri, self.output_dir)
-            boss.assign_task(task)
-            if s.is_byterange:
-                break
-
-        for s in segments:
-            print(s.uri)
+        self._queue_segments()
+
+    def _queue_segments(self, window=None):
+        '''
+        Stream segments of the MPD into the task engine as they are generated
+        @param window See MPD.iter_segments()
+        '''
+        counts = {'segments': 0}
+        byteranges = {}  # byte ranges of each resource, coalesced once all segments are seen
+        is_live = self.mpd.is_live()
+        availability_start = self.mpd.availability_start()
+        depth = self.mpd.buffer_depth()
+        # segments of unknown end, e.g. initialization segments, are needed before the media segments of the window
+        window_end = window[1] if window and window[1] is not None else None
+
+        def tasks():
+            for s in self.mpd.iter_segments(window):
+                counts['segments'] += 1
+                if s.byterange:
+                    byteranges.setdefault(s.uri, []).append(s.byterange)
+                    continue
+                priority, deadline = 0, None
+                if is_live:
+                    # newer LIVE segments first, as HLS does by media sequence, before they leave the time shift buffer
+                    end = s.end if s.end is not None else window_end
+                    priority = end or 0
+                    if end is not None and depth is not None:
+                        deadline = availability_start + end + depth
+                # initialization segments are generated in every window of a LIVE MPD, the engine downloads each URI once
+                yield streambot.create_download_task(s.uri, self.output_dir, chunk_size=self.chunk_size, priority=priority, deadline=deadline)
+
+        self._assign_tasks(tasks())
+        self._queue_byteranges(byteranges, window_end or 0)
+        logger.debug('Queue {n} segments from mpd {uri}'.format(n=counts['segments'], uri=self.mpd.uri))
 
     def _report(self):
         pass
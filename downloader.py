@@ -4,40 +4,395 @@ downloader.py
 
 import logging
 import os
+import threading
+import time
 import requests
+try:
+    import urlparse
+except ImportError:
+    # Python 3, for the asyncio engine
+    import urllib.parse as urlparse
+
+import cache
+
 logger = logging.getLogger('downloader.streambot')
 
+_CHUNK_SIZE = 64 * 1024  # bytes
+_POOL_SIZE = 3  # keep-alive connections per host
+_POOL_CONNECTIONS = 10  # number of hosts to keep connection pools for
+_PARTIAL_SUFFIX = '.part'  # suffix of incomplete downloads
+_TIMEOUT = (10, 60)  # seconds, (connect, read) timeout of a request, so a stalled server does not block a worker forever
+
+_RETRYABLE_STATUS_CODES = (408, 429)  # client errors worth a retry, besides all 5xx server errors
+
+_SESSION = None  # requests.Session shared by all downloading threads
+_SESSION_LOCK = threading.Lock()
+_BYTES_DOWNLOADED = 0  # bytes received by all downloading threads of this process
+_BYTES_LOCK = threading.Lock()
+
+_VALIDATORS = {}  # ETag and Last-Modified of the last download of a URI, key: URI, value: dict of headers
+_VALIDATORS_LOCK = threading.Lock()
+
+_RATE_LIMITS = {}  # key: host, None for hosts not listed, value: (bytes per second, requests per second)
+_BUCKETS = {}  # token buckets shared by all downloading threads, key: host, value: (bytes bucket, requests bucket)
+_BUCKETS_LOCK = threading.Lock()
+
+_CACHE = None  # cache.SegmentCache consulted before the network, see open_cache()
+
+
+class DownloadError(Exception):
+    '''
+    retryable False indicating downloading again would fail the same way, e.g. HTTP 404
+    '''
+    def __init__(self, value, retryable=True):
+        self.value = value
+        self.retryable = retryable
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def _is_retryable_status(status):
+    '''
+    @param status HTTP status code of a failed response
+    @return True for 408, 429 and 5xx, e.g. 507 or 520-524 of a CDN
+    '''
+    return status in _RETRYABLE_STATUS_CODES or 500 <= status < 600
+
+
+def _is_retryable(e):
+    '''
+    @param e requests.exceptions.RequestException
+    @return True if the error is likely transient, e.g. connection error, timeout or HTTP 503
+    '''
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and _is_retryable_status(e.response.status_code)
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def _create_session(pool_size):
+    session = requests.Session()
+    session.verify = False
+    adapter = requests.adapters.HTTPAdapter(pool_connections=_POOL_CONNECTIONS, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def open_session(pool_size=_POOL_SIZE):
+    '''
+    Create the keep-alive session shared by all downloading threads
+    Any previously opened session is closed
+
+    @param pool_size Max number of connections kept alive per host, normally the number of workers
+    '''
+    global _SESSION
+    session = _create_session(pool_size)
+
+    _SESSION_LOCK.acquire()
+    old_session = _SESSION
+    _SESSION = session
+    _SESSION_LOCK.release()
+
+    if old_session:
+        old_session.close()
+    logger.debug('open session with pool size {n}'.format(n=pool_size))
+
+
+def close_session():
+    '''
+    Close the shared session and all its pooled connections
+    '''
+    global _SESSION
+    _SESSION_LOCK.acquire()
+    session = _SESSION
+    _SESSION = None
+    _SESSION_LOCK.release()
+
+    if session:
+        session.close()
+
+
+def _get_session():
+    '''
+    @return the shared session, a default one is opened if open_session() has not been called
+    '''
+    global _SESSION
+    _SESSION_LOCK.acquire()
+    if not _SESSION:
+        _SESSION = _create_session(_POOL_SIZE)
+    session = _SESSION
+    _SESSION_LOCK.release()
+    return session
+
+
+def open_cache(directory, max_bytes=cache._MAX_BYTES):
+    '''
+    Serve downloads from a content addressed cache in directory, and add downloaded content to it
+    downloads with clear_local, e.g. playlists, neither use nor fill the cache
+
+    @param directory Cache directory, shared by clones into different output dirs
+    @param max_bytes Size budget of cached content, default 10GB
+    '''
+    global _CACHE
+    _CACHE = cache.SegmentCache(directory, max_bytes)
+
+
+def close_cache():
+    '''
+    Save the cache index and stop using the cache
+    '''
+    global _CACHE
+    segment_cache = _CACHE
+    _CACHE = None
+    if segment_cache:
+        segment_cache.save()
+
+
+def _count_bytes(n):
+    global _BYTES_DOWNLOADED
+    _BYTES_LOCK.acquire()
+    _BYTES_DOWNLOADED += n
+    _BYTES_LOCK.release()
+
+
+def bytes_downloaded():
+    '''
+    @return Number of bytes received by all downloading threads of this process so far, e.g. to measure throughput
+    '''
+    return _BYTES_DOWNLOADED
+
+
+class _TokenBucket(object):
+    '''
+    rate tokens are added per second, up to burst tokens
+    a taker may go into debt, and waits until the debt is paid off, so takers are served in turn
+    '''
+    def __init__(self, rate, burst=None):
+        '''
+        @param rate Tokens per second
+        @param burst Max tokens saved up while idle, default rate, i.e. one second worth
+        '''
+        self.rate = float(rate)
+        self.burst = burst or self.rate
+        self.tokens = self.burst
+        self.time = time.time()
+        self.lock = threading.Lock()
+
+    def reserve(self, n):
+        '''
+        take n tokens
+        @return seconds to wait before using them
+        '''
+        self.lock.acquire()
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+        self.tokens -= n
+        wait = max(0, -self.tokens / self.rate)
+        self.lock.release()
+        return wait
+
+
+def set_rate_limit(bytes_per_second=None, requests_per_second=None, host=None):
+    '''
+    Limit downloads from a host, shared by all downloading threads of this process
+
+    @param bytes_per_second Max bytes per second received from the host, None for no limit
+    @param requests_per_second Max requests per second sent to the host, None for no limit
+    @param host e.g. example.com or example.com:8080, default None, i.e. each host not set explicitly
+    '''
+    _BUCKETS_LOCK.acquire()
+    _RATE_LIMITS[host] = (bytes_per_second, requests_per_second)
+    _BUCKETS.clear()
+    _BUCKETS_LOCK.release()
+
+
+def clear_rate_limits():
+    _BUCKETS_LOCK.acquire()
+    _RATE_LIMITS.clear()
+    _BUCKETS.clear()
+    _BUCKETS_LOCK.release()
+
+
+def _buckets(host):
+    '''
+    @return (bytes bucket, requests bucket) of host, either is None if not limited
+    '''
+    _BUCKETS_LOCK.acquire()
+    if host not in _BUCKETS:
+        bytes_per_second, requests_per_second = _RATE_LIMITS.get(host, _RATE_LIMITS.get(None, (None, None)))
+        _BUCKETS[host] = (_TokenBucket(bytes_per_second) if bytes_per_second else None,
+                          _TokenBucket(requests_per_second) if requests_per_second else None)
+    buckets = _BUCKETS[host]
+    _BUCKETS_LOCK.release()
+    return buckets
+
+
+def _reserve(uri, num_bytes=0, num_requests=0):
+    '''
+    take tokens of the host of uri
+    @return seconds to wait before sending the requests or receiving more than the bytes
+    '''
+    if not _RATE_LIMITS:
+        return 0
+    bytes_bucket, requests_bucket = _buckets(urlparse.urlparse(uri).netloc)
+    wait = 0
+    if num_bytes and bytes_bucket:
+        wait = max(wait, bytes_bucket.reserve(num_bytes))
+    if num_requests and requests_bucket:
+        wait = max(wait, requests_bucket.reserve(num_requests))
+    return wait
+
+
+def _throttle(uri, num_bytes=0, num_requests=0):
+    '''
+    block until the host of uri allows the requests or the bytes
+    '''
+    wait = _reserve(uri, num_bytes, num_requests)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _remember_validators(uri, resp):
+    '''
+    keep ETag and Last-Modified of resp, for conditional downloads of uri later
+    '''
+    validators = dict((k, resp.headers[k]) for k in ('ETag', 'Last-Modified') if resp.headers.get(k))
+    _VALIDATORS_LOCK.acquire()
+    if validators:
+        _VALIDATORS[uri] = validators
+    else:
+        _VALIDATORS.pop(uri, None)
+    _VALIDATORS_LOCK.release()
+
+
+def _conditional_headers(uri):
+    '''
+    @return If-None-Match and If-Modified-Since headers from the last download of uri, empty if not known
+    '''
+    _VALIDATORS_LOCK.acquire()
+    validators = _VALIDATORS.get(uri, {})
+    _VALIDATORS_LOCK.release()
+    headers = {}
+    if 'ETag' in validators:
+        headers['If-None-Match'] = validators['ETag']
+    if 'Last-Modified' in validators:
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+
+def _partial(local):
+    '''
+    @return path of the temporary file local is downloaded to before it is complete
+    '''
+    return local + _PARTIAL_SUFFIX
+
 
-def _download(uri, local):
+def _content_range_total(resp):
+    '''
+    @return (first byte position, complete length) from Content-Range header, None if not present
+    e.g. "bytes 100-199/1000" -> (100, 1000), "bytes */1000" -> (None, 1000)
+    '''
+    content_range = resp.headers.get('Content-Range', '')
+    try:
+        byte_range, total = content_range.split(' ', 1)[1].split('/')
+        first = None if '*' == byte_range else int(byte_range.split('-')[0])
+        return first, int(total)
+    except (IndexError, ValueError):
+        return None
+
+
+def _download(uri, local, chunk_size=_CHUNK_SIZE, conditional=False):
     '''
     download from uri and save as local
+    response body is streamed in chunks to a partial file, which is renamed to local once complete,
+    so at most chunk_size bytes are held in memory and local is never left truncated
+    if a partial file exists from an interrupted download, only the missing bytes are requested
+
     @param uri
     @param local
-    @return True if download succeeds
+    @param chunk_size Number of bytes read from network and written to local at a time
+    @param conditional True to skip the download if uri is not modified since the last download
+    @return True if download succeeds, False if conditional and uri is not modified
+    @raise DownloadError if download fails
     '''
+    partial = _partial(local)
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    headers = {}
+    if offset:
+        # byte offsets of the partial file refer to the identity encoded content
+        headers = {'Range': 'bytes={offset}-'.format(offset=offset), 'Accept-Encoding': 'identity'}
+    if conditional:
+        headers.update(_conditional_headers(uri))
+
+    resp = None
     try:
-        resp = requests.get(uri, verify=False)
-        resp.raise_for_status()
-        with open(local, 'wb') as f:
-            f.write(resp.content)
+        _throttle(uri, num_requests=1)
+        resp = _get_session().get(uri, stream=True, headers=headers, timeout=_TIMEOUT)
+        if conditional and 304 == resp.status_code:
+            resp.close()
+            logger.debug('{uri} is not modified'.format(uri=uri))
+            return False
+        elif offset and 416 == resp.status_code:
+            resp.close()
+            if (None, offset) != _content_range_total(resp):
+                logger.debug('{partial} does not match {uri}, restart download'.format(partial=partial, uri=uri))
+                os.remove(partial)
+                return _download(uri, local, chunk_size, conditional)
+            logger.debug('{partial} is already complete'.format(partial=partial))
+        else:
+            resp.raise_for_status()
+            content_range = _content_range_total(resp)
+            if offset and 206 == resp.status_code and content_range and offset == content_range[0]:
+                logger.debug('resume {uri} from byte {offset}'.format(uri=uri, offset=offset))
+                mode = 'ab'
+            else:
+                mode = 'wb'
+            with open(partial, mode) as f:
+                for chunk in resp.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        _count_bytes(len(chunk))
+                        # not reading from the socket meanwhile slows down the sender
+                        _throttle(uri, num_bytes=len(chunk))
+            resp.close()
+
+        if os.path.exists(local):
+            # a modified resource replaces the local copy
+            os.remove(local)
+        os.rename(partial, local)
+        _remember_validators(uri, resp)
         logger.debug('{uri} downloaded and saved to {local}'.format(uri=uri, local=local))
         return True
     except requests.exceptions.RequestException as e:
         logger.error('Error: RequestException while download {uri}'.format(uri=uri))
         logger.exception(e)
-        return False
+        if resp is not None and resp.headers.get('Content-Encoding') and os.path.exists(partial):
+            # decoded content can not be resumed by byte range
+            os.remove(partial)
+        raise DownloadError('Failed download {uri}: {error}'.format(uri=uri, error=e), _is_retryable(e))
+    except (IOError, OSError) as e:
+        logger.error('Error: {error} while save {local}'.format(error=type(e).__name__, local=local))
+        logger.exception(e)
+        raise DownloadError('Failed save {local}: {error}'.format(local=local, error=e), False)
 
 
-def download(uri, local, clear_local=False):
+def download(uri, local, clear_local=False, chunk_size=_CHUNK_SIZE, raise_error=False):
     '''
     Download resource from uri, save to local, i.e. path/to/target.file (relative to CWD)
 
     @param uri Full URI of the target
     @param local path/to/target.file
     @clear_local True if force to clear local
+    @param chunk_size Number of bytes written to local at a time, default 64KB
+    @param raise_error True to raise DownloadError rather than return False, default False
     @return True indicate download succeeds
     '''
     logger.debug('downloading {uri} to {local}'.format(uri=uri, local=local))
+    if clear_local and os.path.exists(_partial(local)):
+        os.remove(_partial(local))
+
     if os.path.exists(local):
         if clear_local:
             os.remove(local)
@@ -45,16 +400,116 @@ def download(uri, local, clear_local=False):
             logger.debug('{local} exists'.format(local=local))
             return True
 
+    subfolder = os.path.dirname(local)
     try:
-        subfolder = os.path.dirname(local)
         if subfolder and not os.path.exists(subfolder):
             os.makedirs(subfolder)
     except OSError as e:
-        logger.error('Error: OSError while create folder {subfolder}'.format(subfolder=subfolder))
-        logger.exception(e)
+        # another thread may have created the same folder meanwhile
+        if not os.path.isdir(subfolder):
+            logger.error('Error: OSError while create folder {subfolder}'.format(subfolder=subfolder))
+            logger.exception(e)
+            if raise_error:
+                raise DownloadError('Failed create folder {subfolder}'.format(subfolder=subfolder))
+            return False
+
+    segment_cache = _CACHE
+    if segment_cache and not clear_local and segment_cache.get(uri, local):
+        return True
+
+    try:
+        _download(uri, local, chunk_size)
+    except DownloadError:
+        if raise_error:
+            raise
         return False
+    if segment_cache and not clear_local:
+        segment_cache.put(uri, local)
+    return True
+
+
+def download_range(uri, local, first, last, chunk_size=_CHUNK_SIZE):
+    '''
+    Download bytes first to last (inclusive) of uri, and write them at the same offsets of local
+    several threads may download different ranges of one uri into one local at a time,
+    each writes only its own bytes, local is created if it does not exist
+
+    @param uri Full URI of the target
+    @param local path/to/target.file
+    @param first Offset of the first byte
+    @param last Offset of the last byte
+    @param chunk_size Number of bytes written to local at a time, default 64KB
+    @return True if download succeeds
+    @raise DownloadError if download fails or the response is shorter than the range
+    '''
+    logger.debug('downloading bytes {first}-{last} of {uri} to {local}'.format(first=first, last=last, uri=uri, local=local))
+    subfolder = os.path.dirname(local)
+    try:
+        if subfolder and not os.path.exists(subfolder):
+            os.makedirs(subfolder)
+    except OSError:
+        if not os.path.isdir(subfolder):
+            raise DownloadError('Failed create folder {subfolder}'.format(subfolder=subfolder))
 
-    return _download(uri, local)
+    # byte offsets refer to the identity encoded content
+    headers = {'Range': 'bytes={first}-{last}'.format(first=first, last=last), 'Accept-Encoding': 'identity'}
+    try:
+        _throttle(uri, num_requests=1)
+        resp = _get_session().get(uri, stream=True, headers=headers, timeout=_TIMEOUT)
+        resp.raise_for_status()
+        if 206 == resp.status_code:
+            position = first
+            content_range = _content_range_total(resp)
+            if content_range and first != content_range[0]:
+                resp.close()
+                raise DownloadError('Unexpected Content-Range of {uri}: {value}'.format(uri=uri, value=resp.headers['Content-Range']))
+        else:
+            # the server ignores Range, the content before first is the same as local has
+            logger.debug('{uri} does not support byte range'.format(uri=uri))
+            position = 0
+
+        # O_CREAT without O_TRUNC keeps the bytes other threads write
+        with os.fdopen(os.open(local, os.O_RDWR | os.O_CREAT, 0o644), 'r+b') as f:
+            f.seek(position)
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    chunk = chunk[:last + 1 - position]
+                    f.write(chunk)
+                    position += len(chunk)
+                    _count_bytes(len(chunk))
+                    if position > last:
+                        break
+                    _throttle(uri, num_bytes=len(chunk))
+        resp.close()
+    except requests.exceptions.RequestException as e:
+        logger.error('Error: RequestException while download {uri}'.format(uri=uri))
+        logger.exception(e)
+        raise DownloadError('Failed download {uri}: {error}'.format(uri=uri, error=e), _is_retryable(e))
+    except (IOError, OSError) as e:
+        logger.error('Error: {error} while save {local}'.format(error=type(e).__name__, local=local))
+        logger.exception(e)
+        raise DownloadError('Failed save {local}: {error}'.format(local=local, error=e), False)
+
+    if position <= last:
+        raise DownloadError('Bytes {first}-{last} of {uri} end at {position}'.format(first=first, last=last, uri=uri, position=position))
+    logger.debug('bytes {first}-{last} of {uri} saved to {local}'.format(first=first, last=last, uri=uri, local=local))
+    return True
+
+
+def download_if_modified(uri, local, chunk_size=_CHUNK_SIZE):
+    '''
+    Download resource from uri to local, unless it is not modified since the last download,
+    by If-None-Match and If-Modified-Since with ETag and Last-Modified of the last download
+
+    @param uri Full URI of the target
+    @param local path/to/target.file, replaced if uri is modified
+    @param chunk_size Number of bytes written to local at a time, default 64KB
+    @return True if local is downloaded, False if uri is not modified and local is kept
+    @raise DownloadError if download fails
+    '''
+    if not os.path.exists(local) or not _conditional_headers(uri):
+        return download(uri, local, True, chunk_size, raise_error=True)
+    return _download(uri, local, chunk_size, conditional=True)
 
 
 def _example():
@@ -3,7 +3,7 @@
 '''
 hls_clone tool
 '''
-import streambot
+import hls_streambot
 import logging
 
 
@@ -13,6 +13,18 @@ def parse_argument():
     parser.add_argument('--uri', '-u', required=True, help='Master playlist URI')
     parser.add_argument('--output_dir', '-o', help='output_dir. Default is output_dir')
     parser.add_argument('--total_length', '-l', type=int, help='Total length of streams, in seconds, for downloading LIVE streams')
+    parser.add_argument('--chunk_size', '-c', type=int, help='Number of bytes written to disk at a time while downloading segments')
+    parser.add_argument('--bind', '-b', help='Address to accept remote workers on, e.g. tcp://*:5555')
+    parser.add_argument('--max_workers', type=int, help='Max number of workers, to grow and shrink workers by throughput at runtime. Default is 3 workers for the whole run')
+    parser.add_argument('--min_workers', type=int, help='Min number of workers when growing and shrinking workers. Default is 1')
+    parser.add_argument('--max_rate', type=int, help='Max bytes per second downloaded from each host. Default is no limit')
+    parser.add_argument('--max_requests', type=float, help='Max requests per second sent to each host. Default is no limit')
+    parser.add_argument('--engine', '-e', choices=['boss', 'asyncio'], help='Engine downloading segments. Default is boss')
+    parser.add_argument('--concurrency', type=int, help='Max number of concurrent downloads of asyncio engine')
+    parser.add_argument('--host_concurrency', type=int, help='Max number of concurrent downloads from one host of asyncio engine')
+    parser.add_argument('--cache_dir', help='Directory of the segment cache shared by clones, segments cached there are not downloaded again. Default is no cache')
+    parser.add_argument('--cache_size', type=int, help='Max bytes of segments kept in the cache. Default is 10GB')
+    parser.add_argument('--no_resume', action='store_true', help='Download again segments done by an interrupted clone into the same output_dir')
     parser.add_argument('--verbose', '-v', help="increase output verbosity", action="store_true")
     args = parser.parse_args()
     return args
@@ -23,13 +35,46 @@ def main():
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
 
-    hls_stream_bot = streambot.HLSStreamBot(args.uri)
+    hls_stream_bot = hls_streambot.HLSStreamBot(args.uri)
     if args.output_dir:
         hls_stream_bot.output_dir = args.output_dir
 
     if args.total_length:
         hls_stream_bot.total_length = args.total_length
 
+    if args.chunk_size:
+        hls_stream_bot.chunk_size = args.chunk_size
+
+    if args.bind:
+        hls_stream_bot.boss_bind = args.bind
+
+    if args.max_workers:
+        hls_stream_bot.max_worker = args.max_workers
+
+    if args.min_workers:
+        hls_stream_bot.min_worker = args.min_workers
+
+    if args.max_rate or args.max_requests:
+        hls_stream_bot.rate_limits[None] = (args.max_rate, args.max_requests)
+
+    if args.engine:
+        hls_stream_bot.engine = args.engine
+
+    if args.concurrency:
+        hls_stream_bot.concurrency = args.concurrency
+
+    if args.host_concurrency:
+        hls_stream_bot.host_concurrency = args.host_concurrency
+
+    if args.cache_dir:
+        hls_stream_bot.cache_dir = args.cache_dir
+
+    if args.cache_size:
+        hls_stream_bot.cache_size = args.cache_size
+
+    if args.no_resume:
+        hls_stream_bot.resume = False
+
     hls_stream_bot.run()
 
 if __name__ == '__main__':
@@ -3,10 +3,20 @@
 '''
 hls_streambot.py
 '''
-import boss
-import urlparse
+try:
+    import urlparse
+except ImportError:
+    # Python 3, for the asyncio engine
+    import urllib.parse as urlparse
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import heapq
+import itertools
 import logging
 import os
+import threading
 import time
 import sys
 import m3u8
@@ -15,17 +25,72 @@ import streambot
 
 logger = logging.getLogger('streambot.hls_streambot')
 
+_TARGET_DURATION = 10  # seconds, of playlists without #EXT-X-TARGETDURATION
 
-class HLSSegment():
-    def __init__(self, uri, is_byterange):
+
+class _PlaylistThread(threading.Thread):
+    '''
+    download and parse playlists from playlists_in queue until it is empty
+    put (playlist, None) or (playlist, error) to results_out queue
+    '''
+    def __init__(self, playlists_in, results_out, output_dir):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.playlists_in = playlists_in
+        self.results_out = results_out
+        self.output_dir = output_dir
+
+    def run(self):
+        while True:
+            try:
+                playlist = self.playlists_in.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                playlist.download_and_save(self.output_dir)
+                self.results_out.put((playlist, None))
+            except Exception as e:
+                self.results_out.put((playlist, e))
+
+
+def download_playlists(playlists, output_dir, concurrency=streambot._PLAYLIST_CONCURRENCY):
+    '''
+    Download and parse playlists concurrently
+    @param playlists HLSPlaylist list
+    @param concurrency Max number of playlists downloaded at a time
+    @return generator of playlists as soon as each is parsed, playlists failed to download are logged and skipped
+    '''
+    playlists_in = queue.Queue()
+    results_out = queue.Queue()
+    for p in playlists:
+        playlists_in.put(p)
+    for i in range(min(concurrency, len(playlists))):
+        _PlaylistThread(playlists_in, results_out, output_dir).start()
+
+    for i in range(len(playlists)):
+        playlist, error = results_out.get()
+        if error:
+            logger.error('Failed download playlist {uri}: {error}'.format(uri=playlist.uri, error=error))
+            continue
+        yield playlist
+
+
+class HLSSegment(object):
+    __slots__ = ('uri', 'is_byterange', 'sequence', 'byterange')
+
+    def __init__(self, uri, is_byterange, sequence=None, byterange=None):
         '''
         @param uri Absolute URI of segment
+        @param sequence Media sequence number of segment, default None
+        @param byterange (first, last) byte offsets of the segment in uri, default None
         '''
         if not streambot.is_full_uri(uri):
             raise streambot.StreamBotError('HLSSegment URI is not absolute: {uri}'.format(uri=uri))
 
         self.uri = uri
         self.is_byterange = is_byterange
+        self.sequence = sequence
+        self.byterange = byterange
 
     def log(self):
         logger.debug('Segment URI: {uri}'.format(uri=self.uri))
@@ -41,17 +106,28 @@ class HLSPlaylist():
 
         self.uri = uri
         self.playlist = None
+        self.content = None
+        self.changed = True  # False if the last download_and_save() got the same playlist as the one before
+        self.last_sequence = None  # media sequence number of the last segment returned by parse_new_segments()
+        self.missed_segments = 0  # number of segments out of the LIVE window before they are parsed
 
     def download_and_save(self, output_dir=streambot._OUTPUT_DIR):
         '''
         download and save playlist
         also parse media playlists
+        a playlist not modified since the last download is neither downloaded nor parsed again
         '''
-        self.local = streambot.download_and_save_to(self.uri, output_dir, True)
+        self.local, modified = streambot.refresh_and_save_to(self.uri, output_dir)
+        if not modified and self.playlist:
+            logger.debug('stream playlist {uri} is not modified'.format(uri=self.uri))
+            self.changed = False
+            return
         logger.debug('stream playlist is saved as: {local}'.format(local=self.local))
 
         with open(self.local, 'r') as f:
             content = f.read()
+            self.changed = content != self.content
+            self.content = content
             self.playlist = m3u8.loads(content)
 
     def is_variant(self):
@@ -87,14 +163,56 @@ class HLSPlaylist():
         if self.playlist.is_variant:
             return []
 
+        return self._make_segments(0)
+
+    def parse_new_segments(self):
+        '''
+        Parse segments newer than those returned last time, by media sequence number
+        segments between the last one returned and the first one in the playlist are counted as missed_segments
+        @return list of new HLSSegment
+        '''
+        if self.playlist.is_variant:
+            return []
+
+        media_sequence = self.playlist.media_sequence or 0
+        last_sequence = media_sequence + len(self.playlist.segments) - 1
+        start = 0
+        if self.last_sequence is not None:
+            if last_sequence < self.last_sequence:
+                logger.error('media sequence of {uri} restarts from {n}'.format(uri=self.uri, n=media_sequence))
+            elif media_sequence > self.last_sequence + 1:
+                missed = media_sequence - self.last_sequence - 1
+                logger.error('{n} segments of {uri} missed'.format(n=missed, uri=self.uri))
+                self.missed_segments += missed
+            else:
+                start = self.last_sequence + 1 - media_sequence
+
+        segments = self._make_segments(start)
+        if self.playlist.segments:
+            self.last_sequence = last_sequence
+        return segments
+
+    def _make_segments(self, start):
+        '''
+        @param start Index of the first segment in the playlist
+        @return list of HLSSegment from start
+        '''
         segments = []
-        for s in self.playlist.segments:
+        media_sequence = self.playlist.media_sequence or 0
+        next_offset = {}  # key: URI, value: offset following the last sub-range of the URI
+        for i, s in enumerate(self.playlist.segments):
             if s.uri.startswith('#'):
                 continue
-            if streambot.is_full_uri(s.uri):
-                segments.append(HLSSegment(uri=s.uri, is_byterange=s.byterange))
-            else:
-                segments.append(HLSSegment(uri=urlparse.urljoin(self.uri, s.uri), is_byterange=s.byterange))
+            uri = s.uri if streambot.is_full_uri(s.uri) else urlparse.urljoin(self.uri, s.uri)
+            byterange = None
+            if s.byterange:
+                # EXT-X-BYTERANGE:<length>[@<offset>], without offset the sub-range follows the previous one of the same URI
+                length, _, offset = s.byterange.partition('@')
+                first = int(offset) if offset else next_offset.get(uri, 0)
+                byterange = (first, first + int(length) - 1)
+                next_offset[uri] = first + int(length)
+            if i >= start:
+                segments.append(HLSSegment(uri=uri, is_byterange=s.byterange, sequence=media_sequence + i, byterange=byterange))
         return segments
 
     def is_live(self):
@@ -103,6 +221,15 @@ class HLSPlaylist():
     def target_duration(self):
         return self.playlist.target_duration
 
+    def reload_delay(self):
+        '''
+        RFC 8216 6.3.4, wait the target duration before reloading a live playlist,
+        or half of it if the playlist has not changed since the last reload
+        @return seconds to wait from the time the last reload began
+        '''
+        target_duration = self.target_duration() or _TARGET_DURATION
+        return target_duration if self.changed else target_duration / 2.0
+
 
 class HLSStreamBot(streambot.Bot):
     '''
@@ -119,76 +246,105 @@ class HLSStreamBot(streambot.Bot):
 
     def run(self):
         try:
-            boss.start(num_workers=self.num_worker, action=streambot._download_task_action)
+            self._start_engine()
 
             self._get_master_playlist()
             self._get_media_playlists()
-            if self.media_playlists[0].is_live():
+            if self._is_live():
                 self._get_live_stream()
-            else:
-                self._get_segments()
 
-            while not boss.have_all_tasks_done():
-                time.sleep(1)
+            self.task_engine.wait_all()
 
         except Exception as e:
             logger.exception(e)
         finally:
-            boss.stop()
+            self._stop_engine()
             self._report()
 
+    def _is_live(self):
+        '''
+        @return True if any media playlist downloaded is LIVE
+        '''
+        downloaded = [p for p in self.media_playlists if p.playlist]
+        if not downloaded:
+            raise streambot.StreamBotError('No media playlist of {uri} downloaded'.format(uri=self.master_playlist.uri))
+        return any(p.is_live() for p in downloaded)
+
+    def _reload_delay(self, playlist):
+        return self.refresh_interval or playlist.reload_delay()
+
     def _get_live_stream(self):
-        if not self.refresh_interval:
-            self.refresh_interval = self.media_playlists[0].target_duration() / 2
-        logger.debug('Refresh LIVE playlist at interval {interval} seconds'.format(interval=self.refresh_interval))
-        length = 0
-        while True:
-            self._get_segments()
-            time.sleep(self.refresh_interval)
-            length += self.refresh_interval
-            logger.debug('Refresh LIVE playlist for {length} seconds'.format(length=length))
-            if length > self.total_length:
-                break
-            self._get_master_playlist()
-            self._get_media_playlists()
+        '''
+        refresh each LIVE media playlist on its own timer, see HLSPlaylist.reload_delay(),
+        until total_length seconds or the playlist ends with #EXT-X-ENDLIST
+        the timer counts from the time a refresh begins, so slow refreshes do not drift behind the LIVE edge
+        segments of refreshed playlists are queued as soon as each is parsed
+        '''
+        start = time.time()
+        schedule = []  # heap of (time to refresh, sequence, playlist)
+        sequence = itertools.count()
+        for p in self.media_playlists:
+            if p.playlist and p.is_live():
+                heapq.heappush(schedule, (start + self._reload_delay(p), next(sequence), p))
+
+        while schedule and schedule[0][0] - start <= self.total_length:
+            time.sleep(max(0, schedule[0][0] - time.time()))
+            began = time.time()
+            due = []
+            while schedule and schedule[0][0] <= began:
+                due.append(heapq.heappop(schedule)[-1])
+            logger.debug('Refresh {n} LIVE playlists at {length:.1f} seconds'.format(n=len(due), length=began - start))
+
+            for p in download_playlists(due, self.output_dir, self.playlist_concurrency):
+                self._get_segments_from_playlist(p)
+
+            for p in due:
+                if not p.is_live():
+                    logger.debug('{uri} ends'.format(uri=p.uri))
+                    continue
+                heapq.heappush(schedule, (began + self._reload_delay(p), next(sequence), p))
 
     def _get_master_playlist(self):
         '''
         Download and save master playlist
         '''
-        self.master_playlist.download_and_save()
+        self.master_playlist.download_and_save(self.output_dir)
         self.master_playlist.log()
 
     def _get_media_playlists(self):
-        if self.master_playlist.is_variant:
-            self.media_playlists = self.master_playlist.parse_media_playlists()
-        else:
-            self.media_playlists.append(self.master_playlist)
-        logger.debug('{n} playlists added'.format(n=len(self.media_playlists)))
-        for m in self.media_playlists:
-            m.download_and_save()
-
-    def _get_segments(self):
         '''
-        Get and save segments from stream playlists
+        Download media playlists concurrently, and queue segments of each as soon as it is parsed
         '''
-        # TODO: Implement a Breadth-First-Search
-        for media_playlist in self.media_playlists:
-            self._get_segments_from_playlist(media_playlist)
+        if self.master_playlist.is_variant():
+            self.media_playlists = self.master_playlist.parse_media_playlists()
+            logger.debug('{n} playlists added'.format(n=len(self.media_playlists)))
+            for m in download_playlists(self.media_playlists, self.output_dir, self.playlist_concurrency):
+                self._get_segments_from_playlist(m)
+        else:
+            self.media_playlists = [self.master_playlist]
+            self._get_segments_from_playlist(self.master_playlist)
 
     def _get_segments_from_playlist(self, playlist):
         '''
         Get and save segments from a playlist
-        Assign download tasks to boss
+        Assign download tasks of segments not assigned yet to the task engine
         @param playlist
         '''
-        segments = playlist.parse_segments()
+        segments = playlist.parse_new_segments()
         logger.debug('Download {n} segments from playlist {uri}'.format(n=len(segments), uri=playlist.uri))
+        is_live = playlist.is_live()
+        byteranges = {}  # sub-ranges of each resource, coalesced once all segments are seen
+        tasks = []
         for s in segments:
-            task = streambot.create_download_task(s.uri, self.output_dir)
-            boss.assign_task(task)
-            if s.is_byterange:
-                break
+            if s.byterange:
+                byteranges.setdefault(s.uri, []).append(s.byterange)
+                continue
+            # newer LIVE segments first, before they fall out of the LIVE window
+            priority = s.sequence if is_live else 0
+            tasks.append(streambot.create_download_task(s.uri, self.output_dir, chunk_size=self.chunk_size, priority=priority))
+        self._assign_tasks(tasks)
+        if byteranges:
+            self._queue_byteranges(byteranges, segments[-1].sequence if is_live else 0)
 
     def _report(self):
         '''
@@ -204,10 +360,12 @@ class HLSStreamBot(streambot.Bot):
             media_playlist_downloaded = os.path.exists(streambot._get_local(p.uri, self.output_dir))
             mark = 'DONE' if media_playlist_downloaded else 'FAILED'
             sys.stdout.write('[{mark}] Media playlist {uri} \n'.format(mark=mark, uri=p.uri))
-            segments = p.parse_segments()
+            segments = p.parse_segments() if p.playlist else []
             num_segments_downloaded = 0
             for s in segments:
                 if os.path.exists(streambot._get_local(s.uri, self.output_dir)):
                     num_segments_downloaded += 1
             sys.stdout.write('    [{num_downloaded}/{num_total}] Segments downloaded \n'.format(num_downloaded=num_segments_downloaded, num_total=len(segments)))
+            if p.missed_segments:
+                sys.stdout.write('    [{n}] Segments missed out of LIVE window \n'.format(n=p.missed_segments))
         sys.stdout.flush()
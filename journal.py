@@ -0,0 +1,102 @@
+'''
+journal.py
+
+Append-only journal of finished tasks, so an interrupted clone resumes without downloading
+or checking the segments it has finished
+
+each line is the state and the id of a finished Task, e.g. "D http://host/path/s1.ts",
+the last line of a Task wins, and a line cut short by a kill is dropped on open
+
+Interfaces:
+    Journal(path, resume=True)
+        done_tasks():
+        record(task_id, state):
+        flush():
+        close():
+'''
+import logging
+import os
+import threading
+
+logger = logging.getLogger('journal.streambot')
+
+_STATES = {'done': b'D', 'failed': b'F'}
+_COMPACT_RATIO = 2  # the journal is rewritten on open once it has this many lines per Task
+
+
+class Journal(object):
+    def __init__(self, path, resume=True):
+        '''
+        @param path Journal file, created with its folder if it does not exist
+        @param resume True to replay the journal of a previous run, False to start a new one, default True
+        '''
+        self.path = path
+        self.lock = threading.Lock()
+        self.states = {}  # state of Tasks finished in previous runs, key: Task id, value: 'done' or 'failed'
+
+        subfolder = os.path.dirname(path)
+        if subfolder and not os.path.isdir(subfolder):
+            os.makedirs(subfolder)
+        if resume and os.path.exists(path):
+            self._replay()
+        self.file = open(path, 'ab' if resume else 'wb')
+
+    def _replay(self):
+        names = dict((code, state) for state, code in _STATES.items())
+        num_lines = 0
+        valid_length = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                valid_length += len(line)
+                num_lines += 1
+                state = names.get(line[:1])
+                if state:
+                    self.states[line[2:-1].decode('utf-8')] = state
+        logger.debug('replay journal {path}: {n} finished tasks'.format(path=self.path, n=len(self.states)))
+
+        if num_lines > _COMPACT_RATIO * len(self.states):
+            self._rewrite()
+        elif valid_length < os.path.getsize(self.path):
+            # drop the line cut short, so the next line starts on its own
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_length)
+
+    def _rewrite(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            for task_id, state in self.states.items():
+                f.write(self._line(task_id, state))
+        if 'nt' == os.name:
+            os.remove(self.path)
+        os.rename(temporary, self.path)
+
+    def _line(self, task_id, state):
+        return _STATES[state] + b' ' + u'{id}\n'.format(id=task_id).encode('utf-8')
+
+    def done_tasks(self):
+        '''
+        @return set of ids of Tasks done in previous runs
+        '''
+        return set(task_id for task_id, state in self.states.items() if 'done' == state)
+
+    def record(self, task_id, state):
+        '''
+        Append the final state of a Task, written to disk by flush()
+        @param task_id Task id, recorded as text
+        @param state 'done' or 'failed'
+        '''
+        self.lock.acquire()
+        self.file.write(self._line(task_id, state))
+        self.lock.release()
+
+    def flush(self):
+        self.lock.acquire()
+        self.file.flush()
+        self.lock.release()
+
+    def close(self):
+        self.lock.acquire()
+        self.file.close()
+        self.lock.release()
@@ -5,20 +5,43 @@ streambot.py
 '''
 import boss
 import downloader
-import urlparse
+import journal
+try:
+    import urlparse
+except ImportError:
+    # Python 3, for the asyncio engine
+    import urllib.parse as urlparse
 import logging
 import os
 
 logger = logging.getLogger('streambot.streambot')
 
 _NUM_WORKER = 3
+_MIN_WORKER = 1  # min number of workers when autoscaling
+_PLAYLIST_CONCURRENCY = 4  # max number of media playlists downloaded at a time
 _REFRESH_INTERVAL = None  # second
 _TOTAL_LENGTH = 60  # second
 _OUTPUT_DIR = 'output'
+_CHUNK_SIZE = downloader._CHUNK_SIZE  # bytes
+_MAX_ATTEMPTS = 3  # times a segment download is tried
+_ENGINE = 'boss'  # 'boss' or 'asyncio'
+_CONCURRENCY = 100  # concurrent downloads of asyncio engine
+_HOST_CONCURRENCY = 10  # concurrent downloads from one host of asyncio engine
+_MIN_RANGE_SIZE = 1024 * 1024  # bytes, coalesced byte ranges are not split into smaller requests
+_CACHE_SIZE = 10 * 1024 * 1024 * 1024  # bytes of segments kept in cache_dir
+_JOURNAL_FILE = '.streambot_journal'  # journal of finished tasks in output_dir
+_ASSIGN_BATCH = 1000  # tasks assigned to the task engine at a time
 
 
 def _download_task_action(task):
-    return downloader.download(task.command['uri'], task.command['local'], task.command['clear_local'])
+    chunk_size = task.command.get('chunk_size', _CHUNK_SIZE)
+    byterange = task.command.get('byterange')
+    try:
+        if byterange:
+            return downloader.download_range(task.command['uri'], task.command['local'], byterange[0], byterange[1], chunk_size)
+        return downloader.download(task.command['uri'], task.command['local'], task.command['clear_local'], chunk_size, raise_error=True)
+    except downloader.DownloadError as e:
+        raise boss.TaskError(e.value, e.retryable)
 
 
 def _get_local(uri, output_dir):
@@ -27,16 +50,51 @@ def _get_local(uri, output_dir):
     return local
 
 
-def create_download_task(uri, output_dir, clear_local=False):
+def create_download_task(uri, output_dir, clear_local=False, chunk_size=_CHUNK_SIZE, priority=0, deadline=None, byterange=None):
     '''
     @param uri Absolute URI
+    @param chunk_size Number of bytes the worker writes to local at a time
+    @param priority Task of higher priority is downloaded first, default 0
+    @param deadline time.time() by when the download should be done, default None
+    @param byterange (first, last) byte offsets to download into the same offsets of local, default None for the whole uri
     '''
     if not is_full_uri(uri):
         raise StreamBotError('{uri} is not full URI'.format(uri=uri))
 
     local = _get_local(uri, output_dir)
-    cmd = {'uri': uri, 'local': local, 'clear_local': clear_local}
-    return boss.Task(uri, cmd, 'START')
+    cmd = {'uri': uri, 'local': local, 'clear_local': clear_local, 'chunk_size': chunk_size}
+    task_id = uri
+    if byterange:
+        cmd['byterange'] = list(byterange)
+        task_id = '{uri}#bytes={first}-{last}'.format(uri=uri, first=byterange[0], last=byterange[1])
+    return boss.Task(task_id, cmd, 'START', priority, deadline)
+
+
+def coalesce_byteranges(byteranges, parts=1, min_size=_MIN_RANGE_SIZE):
+    '''
+    Merge overlapping and adjacent byte ranges of one resource, then split them into about parts ranges,
+    so the resource is downloaded by a few parallel requests rather than one per segment
+    @param byteranges Iterable of (first, last) byte offsets
+    @param parts Number of ranges wanted, e.g. number of workers, default 1
+    @param min_size Ranges are not split below min_size bytes, default 1MB
+    @return list of (first, last) in order
+    '''
+    merged = []
+    for first, last in sorted(byteranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+
+    total = sum(last - first + 1 for first, last in merged)
+    part_size = max(min_size, -(-total // max(1, parts)))
+    coalesced = []
+    for first, last in merged:
+        while last - first + 1 > part_size:
+            coalesced.append((first, first + part_size - 1))
+            first += part_size
+        coalesced.append((first, last))
+    return coalesced
 
 
 def download_and_save_to(uri, output_dir, clear_local):
@@ -58,6 +116,32 @@ def download_and_save_to(uri, output_dir, clear_local):
     return local
 
 
+def refresh_and_save_to(uri, output_dir):
+    '''
+    Download URI and save content to output, unless it is not modified since the last download
+    @param uri Absolute URI
+    @param output_dir
+    @return (local, True if downloaded or False if not modified)
+    '''
+    if not is_full_uri(uri):
+        raise StreamBotError('{uri} is not full URI'.format(uri=uri))
+
+    local = _get_local(uri, output_dir)
+    try:
+        modified = downloader.download_if_modified(uri, local)
+    except downloader.DownloadError as e:
+        raise StreamBotError('Failed download {uri}: {error}'.format(uri=uri, error=e))
+    return local, modified
+
+
+def _import_aio_engine():
+    try:
+        import aio_engine
+    except (ImportError, SyntaxError) as e:
+        raise StreamBotError('asyncio engine requires Python 3.5+ and aiohttp: {error}'.format(error=e))
+    return aio_engine
+
+
 def is_full_uri(uri):
     return uri.startswith('http://') or uri.startswith('https://')
 
@@ -73,6 +157,94 @@ class StreamBotError(Exception):
 class Bot():
     def __init__(self):
         self.num_worker = _NUM_WORKER
+        self.min_worker = _MIN_WORKER
+        self.max_worker = None  # grow and shrink workers from num_worker by throughput, None to keep num_worker workers
         self.refresh_interval = _REFRESH_INTERVAL
         self.total_length = _TOTAL_LENGTH
         self.output_dir = os.path.join(os.getcwd(), _OUTPUT_DIR)
+        self.chunk_size = _CHUNK_SIZE
+        self.playlist_concurrency = _PLAYLIST_CONCURRENCY
+        self.rate_limits = {}  # key: host, None for any other host, value: (bytes per second, requests per second)
+        self.boss_bind = None  # e.g. tcp://*:5555 to accept remote workers
+        self.max_attempts = _MAX_ATTEMPTS
+        self.engine = _ENGINE
+        self.concurrency = _CONCURRENCY
+        self.host_concurrency = _HOST_CONCURRENCY
+        self.cache_dir = None  # directory of the segment cache shared by clones, None for no cache
+        self.cache_size = _CACHE_SIZE
+        self.resume = True  # skip tasks done by an interrupted run into the same output_dir, per its journal
+        self.journal = None  # journal.Journal of output_dir, set by _start_engine()
+        self.done_tasks = set()  # ids of tasks done by previous runs
+        self.resumed_tasks = 0  # number of tasks skipped as done by previous runs
+        self.task_engine = boss  # module running download tasks, set by _start_engine()
+
+    def _start_engine(self):
+        '''
+        start engine running download tasks, boss or asyncio engine, according to self.engine
+        '''
+        if self.engine not in ('boss', 'asyncio'):
+            raise StreamBotError('Unknown engine: {engine}'.format(engine=self.engine))
+
+        # one keep-alive connection per worker, plus those for playlist refreshing
+        downloader.open_session(max(self.num_worker, self.max_worker or 0) + self.playlist_concurrency)
+        if self.cache_dir:
+            downloader.open_cache(self.cache_dir, self.cache_size)
+        for host, (bytes_per_second, requests_per_second) in self.rate_limits.items():
+            downloader.set_rate_limit(bytes_per_second, requests_per_second, host)
+        self.journal = journal.Journal(os.path.join(self.output_dir, _JOURNAL_FILE), self.resume)
+        self.done_tasks = self.journal.done_tasks()
+        self.resumed_tasks = 0
+        retry_policy = boss.RetryPolicy(self.max_attempts)
+        autoscale = None
+        if self.max_worker:
+            autoscale = boss.AutoscalePolicy(self.min_worker, self.max_worker, throughput=downloader.bytes_downloaded)
+        if 'asyncio' == self.engine:
+            self.task_engine = _import_aio_engine()
+            self.task_engine.start(self.concurrency, self.host_concurrency, retry_policy, journal=self.journal)
+        else:
+            self.task_engine = boss
+            boss.start(num_workers=self.num_worker, action=_download_task_action, bind=self.boss_bind, retry_policy=retry_policy, autoscale=autoscale,
+                       journal=self.journal)
+
+    def _queue_byteranges(self, byteranges, priority=0):
+        '''
+        Assign download tasks of coalesced byte ranges, see coalesce_byteranges(), one set per resource
+        @param byteranges dict, key: URI, value: list of (first, last) byte offsets of segments
+        @param priority Priority of the tasks, default 0
+        '''
+        parts = max(self.num_worker, self.max_worker or 0)
+        tasks = []
+        for uri, ranges in byteranges.items():
+            coalesced = coalesce_byteranges(ranges, parts)
+            logger.debug('Download {n} byte ranges of {uri} in {m} requests'.format(n=len(ranges), uri=uri, m=len(coalesced)))
+            for byterange in coalesced:
+                tasks.append(create_download_task(uri, self.output_dir, chunk_size=self.chunk_size, priority=priority, byterange=byterange))
+        self._assign_tasks(tasks)
+
+    def _assign_tasks(self, tasks):
+        '''
+        Assign tasks to the task engine in batches of _ASSIGN_BATCH, skipping those done by a previous run
+        @param tasks Iterable of Task, consumed lazily, so a generator is never held in memory as a whole
+        '''
+        batch = []
+        for task in tasks:
+            if task.id in self.done_tasks:
+                self.resumed_tasks += 1
+                continue
+            batch.append(task)
+            if len(batch) >= _ASSIGN_BATCH:
+                self.task_engine.assign_tasks(batch)
+                batch = []
+        if batch:
+            self.task_engine.assign_tasks(batch)
+
+    def _stop_engine(self):
+        self.task_engine.stop()
+        downloader.close_session()
+        downloader.clear_rate_limits()
+        downloader.close_cache()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+        if self.resumed_tasks:
+            logger.debug('{n} tasks done by previous runs are skipped'.format(n=self.resumed_tasks))
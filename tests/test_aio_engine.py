@@ -0,0 +1,72 @@
+import unittest
+import os
+import shutil
+import boss
+import streambot
+
+try:
+    import aio_engine
+except (ImportError, SyntaxError):
+    aio_engine = None
+
+
+@unittest.skipIf(aio_engine is None, 'asyncio engine requires Python 3.5+ and aiohttp')
+class TastAioEngine(unittest.TestCase):
+    def setUp(self):
+        self.uri = r'https://bootstrap.pypa.io/get-pip.py'
+        self.output_dir = 'output_dir'
+
+    def tearDown(self):
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def test_download_tasks(self):
+        aio_engine.start()
+        task = streambot.create_download_task(self.uri, self.output_dir)
+        aio_engine.assign_task(task)
+        aio_engine.assign_task(task)
+        all_done = aio_engine.wait_all(timeout=30)
+        aio_engine.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(aio_engine.stats(), {'pending': 0, 'done': 1, 'failed': 0, 'total': 1})
+        self.assertTrue(os.path.exists(task.command['local']))
+
+    def test_tasks_started_by_priority_then_deadline(self):
+        started = []
+
+        async def recording_download(command):
+            started.append(command['uri'])
+
+        download = aio_engine._download
+        aio_engine._download = recording_download
+        aio_engine.start(concurrency=1)
+        tasks = [streambot.create_download_task('http://example.com/{i}.ts'.format(i=i), self.output_dir) for i in range(3)]
+        tasks.append(streambot.create_download_task('http://example.com/late.ts', self.output_dir, priority=10, deadline=200))
+        tasks.append(streambot.create_download_task('http://example.com/live.ts', self.output_dir, priority=10, deadline=100))
+        aio_engine.assign_tasks(tasks)
+        all_done = aio_engine.wait_all(timeout=10)
+        aio_engine.stop()
+        aio_engine._download = download
+        self.assertTrue(all_done)
+        self.assertEqual(started, ['http://example.com/live.ts', 'http://example.com/late.ts',
+                                   'http://example.com/0.ts', 'http://example.com/1.ts', 'http://example.com/2.ts'])
+
+    def test_failed_tasks_retried(self):
+        aio_engine.start(retry_policy=boss.RetryPolicy(max_attempts=2, backoff=0.01))
+        task = streambot.create_download_task('http://bad.url.example/not.exist', self.output_dir)
+        aio_engine.assign_task(task)
+        all_done = aio_engine.wait_all(timeout=30)
+        aio_engine.stop()
+        self.assertTrue(all_done)
+        self.assertTrue(task.is_failed())
+        self.assertEqual(task.attempts, 2)
+
+    def test_fatal_error_not_retried(self):
+        aio_engine.start(retry_policy=boss.RetryPolicy(max_attempts=2, backoff=0.01))
+        task = streambot.create_download_task('https://bootstrap.pypa.io/not.exist', self.output_dir)
+        aio_engine.assign_task(task)
+        all_done = aio_engine.wait_all(timeout=30)
+        aio_engine.stop()
+        self.assertTrue(all_done)
+        self.assertTrue(task.is_failed())
+        self.assertEqual(task.attempts, 1)
@@ -1,6 +1,13 @@
 import unittest
+import multiprocessing
 import boss
 import time
+import sys
+import threading
+import os
+import journal
+
+_BOSS_ADDRESS = 'tcp://127.0.0.1:5555'
 
 
 def done_action(task):
@@ -15,6 +22,50 @@ def half_done_half_failed_action(task):
     return 0 == task.id % 2
 
 
+def slow_action(task):
+    time.sleep(1)
+    return True
+
+
+def hang_action(task):
+    time.sleep(60)
+    return True
+
+
+def succeed_on_third_attempt_action(task):
+    return task.attempts >= 3
+
+
+def fatal_error_action(task):
+    raise boss.TaskError('fatal', retryable=False)
+
+
+_DISPATCHED_TASK_IDS = []
+
+
+def recording_action(task):
+    _DISPATCHED_TASK_IDS.append(task.id)
+    time.sleep(0.5 if 'first' == task.id else 0.01)
+    return True
+
+
+_WORKER_THREAD_IDS = set()
+
+
+def recording_worker_action(task):
+    _WORKER_THREAD_IDS.add(threading.current_thread().ident)
+    time.sleep(0.1)
+    return True
+
+
+def _remote_worker(action, credit=1):
+    endpoints = boss._make_tcp_endpoints(_BOSS_ADDRESS)
+    endpoints['command'] = 'inproc://{id}'
+    worker = boss._WorkerThread(action, endpoints=endpoints, heartbeat=True, credit=credit)
+    worker.start()
+    return worker
+
+
 class TaskBoss(unittest.TestCase):
     def setUp(self):
         pass
@@ -31,12 +82,8 @@ class TaskBoss(unittest.TestCase):
             boss.assign_task(task)
             boss.assign_task(task)
 
-        total_check = 0
-        while not boss.have_all_tasks_done():
-            time.sleep(1)
-            total_check += 1
-            if total_check > 10:
-                self.fail('workers have not stpped in time')
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
 
         boss.stop()
         self.assertEqual(len(boss.tasks()), num_unique_tasks)
@@ -47,12 +94,8 @@ class TaskBoss(unittest.TestCase):
             task = boss.Task(i, {})
             boss.assign_task(task)
 
-        total_check = 0
-        while not boss.have_all_tasks_done():
-            time.sleep(1)
-            total_check += 1
-            if total_check > 10:
-                self.fail('workers have not stpped in time')
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
 
         boss.stop()
         for t in boss._WORKING_THREADS:
@@ -64,12 +107,8 @@ class TaskBoss(unittest.TestCase):
             task = boss.Task(i, {})
             boss.assign_task(task)
 
-        total_check = 0
-        while not boss.have_all_tasks_done():
-            time.sleep(1)
-            total_check += 1
-            if total_check > 10:
-                self.fail('workers have not stpped in time')
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
 
         boss.stop()
         for k, v in boss.tasks().items():
@@ -84,12 +123,8 @@ class TaskBoss(unittest.TestCase):
             task = boss.Task(i, {})
             boss.assign_task(task)
 
-        total_check = 0
-        while not boss.have_all_tasks_done():
-            time.sleep(1)
-            total_check += 1
-            if total_check > 10:
-                self.fail('workers have not stpped in time')
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
 
         boss.stop()
         for k, v in boss.tasks().items():
@@ -101,12 +136,8 @@ class TaskBoss(unittest.TestCase):
             task = boss.Task(i, {})
             boss.assign_task(task)
 
-        total_check = 0
-        while not boss.have_all_tasks_done():
-            time.sleep(1)
-            total_check += 1
-            if total_check > 10:
-                self.fail('workers have not stpped in time')
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
 
         boss.stop()
         for k, v in boss.tasks().items():
@@ -119,15 +150,314 @@ class TaskBoss(unittest.TestCase):
             task = boss.Task(i, {})
             boss.assign_task(task)
 
-        total_check = 0
-        while not boss.have_all_tasks_done():
-            time.sleep(1)
-            total_check += 1
-            if total_check > 10:
-                self.fail('workers have not stpped in time')
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
 
         boss.stop()
         assigned_tasks = boss.tasks()
         self.assertTrue(len(assigned_tasks), num_tasks)
         for k, v in boss.tasks().items():
             self.assertTrue(v.id in range(num_tasks))
+
+    def test_no_op_tasks_throughput(self):
+        boss.start(action=done_action)
+        num_tasks = 2000
+        start_time = time.time()
+        for i in range(num_tasks):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
+
+        tasks_per_second = num_tasks / (time.time() - start_time)
+        boss.stop()
+        sys.stdout.write('\nno-op tasks throughput: {n:.0f} tasks/second\n'.format(n=tasks_per_second))
+        self.assertGreater(tasks_per_second, 200)
+
+    def test_stats(self):
+        boss.start(action=half_done_half_failed_action)
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+            boss.assign_task(task)
+
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
+
+        boss.stop()
+        self.assertEqual(boss.stats(), {'pending': 0, 'done': 5, 'failed': 5, 'total': 10})
+
+    def test_wait_all_timeout(self):
+        boss.start(action=slow_action)
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        self.assertFalse(boss.wait_all(timeout=0.1))
+        self.assertFalse(boss.have_all_tasks_done())
+        self.assertTrue(boss.wait_all(timeout=10))
+        self.assertTrue(boss.have_all_tasks_done())
+        boss.stop()
+
+    def test_wait_all_returns_when_no_task_assigned(self):
+        boss.start(action=done_action)
+        self.assertTrue(boss.wait_all(timeout=0))
+        boss.stop()
+
+    def test_process_mode_done_and_failed_tasks_saved(self):
+        boss.start(action=half_done_half_failed_action, mode='process')
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        if not boss.wait_all(timeout=10):
+            self.fail('workers have not stpped in time')
+
+        boss.stop()
+        for t in boss._WORKING_THREADS:
+            self.assertFalse(t.is_alive())
+        for k, v in boss.tasks().items():
+            if 0 == k % 2:
+                self.assertTrue(v.is_done())
+            else:
+                self.assertTrue(v.is_failed())
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            boss.start(action=done_action, mode='unknown')
+
+    def test_remote_workers(self):
+        boss.start(action=done_action, num_workers=0, bind='tcp://*:5555')
+        workers = [_remote_worker(half_done_half_failed_action) for i in range(2)]
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        all_done = boss.wait_all(timeout=10)
+        for worker in workers:
+            worker.stop()
+            worker.join()
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(boss.stats(), {'pending': 0, 'done': 5, 'failed': 5, 'total': 10})
+
+    def test_worker_takes_several_tasks_per_message(self):
+        boss.start(action=done_action, num_workers=0, bind='tcp://*:5555')
+        boss.assign_tasks(boss.Task(i, {}) for i in range(20))
+        worker = _remote_worker(half_done_half_failed_action, credit=5)
+
+        all_done = boss.wait_all(timeout=10)
+        worker.stop()
+        worker.join()
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(boss.stats(), {'pending': 0, 'done': 10, 'failed': 10, 'total': 20})
+
+    def test_tasks_of_dead_remote_worker_requeued(self):
+        boss.start(action=done_action, num_workers=0, bind='tcp://*:5555')
+        dead_worker = multiprocessing.Process(target=boss.run_worker, args=(hang_action, _BOSS_ADDRESS))
+        dead_worker.start()
+        task = boss.Task(0, {})
+        boss.assign_task(task)
+        time.sleep(2)
+        dead_worker.terminate()
+        dead_worker.join()
+
+        worker = _remote_worker(done_action)
+        all_done = boss.wait_all(timeout=15)
+        worker.stop()
+        worker.join()
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertTrue(boss.tasks()[0].is_done())
+
+    def test_heartbeat_after_bye_ignored(self):
+        boss.start(action=done_action, num_workers=0, bind='tcp://*:5555')
+        dispatcher = [t for t in boss._WORKING_THREADS if isinstance(t, boss._DispatcherThread)][0]
+        worker = _remote_worker(done_action)
+        boss.assign_task(boss.Task(0, {}))
+        all_done = boss.wait_all(timeout=10)
+        worker.stop()
+        worker.join()
+        time.sleep(0.5)
+
+        heartbeat_out = boss._CONTEXT.socket(boss.zmq.DEALER)
+        heartbeat_out.connect(_BOSS_ADDRESS)
+        heartbeat_out.send_multipart([boss._HEARTBEAT, str(worker.id).encode('utf-8')])
+        time.sleep(0.5)
+        workers = list(dispatcher.workers)
+        heartbeat_out.close(linger=0)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(workers, [])
+
+    def test_tasks_dispatched_by_priority_then_deadline(self):
+        del _DISPATCHED_TASK_IDS[:]
+        boss.start(action=recording_action, num_workers=1)
+        # keep the only worker busy while tasks are queued
+        boss.assign_task(boss.Task('first', {}))
+        time.sleep(0.2)
+        boss.assign_task(boss.Task('low', {}, priority=0))
+        boss.assign_task(boss.Task('high late', {}, priority=1, deadline=time.time() + 20))
+        boss.assign_task(boss.Task('high early', {}, priority=1, deadline=time.time() + 10))
+        boss.assign_task(boss.Task('highest', {}, priority=2))
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(_DISPATCHED_TASK_IDS, ['first', 'highest', 'high early', 'high late', 'low'])
+
+    def test_failed_tasks_retried(self):
+        boss.start(action=succeed_on_third_attempt_action, retry_policy=boss.RetryPolicy(max_attempts=3, backoff=0.01))
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        for k, v in boss.tasks().items():
+            self.assertTrue(v.is_done())
+            self.assertEqual(v.attempts, 3)
+
+    def test_failed_tasks_not_retried_more_than_max_attempts(self):
+        boss.start(action=succeed_on_third_attempt_action, retry_policy=boss.RetryPolicy(max_attempts=2, backoff=0.01))
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        for k, v in boss.tasks().items():
+            self.assertTrue(v.is_failed())
+            self.assertEqual(v.attempts, 2)
+
+    def test_fatal_error_not_retried(self):
+        boss.start(action=fatal_error_action, retry_policy=boss.RetryPolicy(max_attempts=3, backoff=0.01))
+        for i in range(10):
+            task = boss.Task(i, {})
+            boss.assign_task(task)
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        for k, v in boss.tasks().items():
+            self.assertTrue(v.is_failed())
+            self.assertFalse(v.retryable)
+            self.assertEqual(v.attempts, 1)
+
+    def test_autoscale_grows_workers_for_backlog(self):
+        _WORKER_THREAD_IDS.clear()
+        autoscale = boss.AutoscalePolicy(min_workers=1, max_workers=4, interval=0.2, min_gain=0)
+        boss.start(action=recording_worker_action, num_workers=1, autoscale=autoscale)
+        for i in range(50):
+            boss.assign_task(boss.Task(i, {}))
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(boss.stats()['done'], 50)
+        self.assertTrue(len(_WORKER_THREAD_IDS) > 1)
+
+    def test_autoscale_retires_idle_workers(self):
+        autoscale = boss.AutoscalePolicy(min_workers=1, max_workers=4, interval=0.2)
+        boss.start(action=done_action, num_workers=4, autoscale=autoscale)
+        for i in range(10):
+            boss.assign_task(boss.Task(i, {}))
+
+        all_done = boss.wait_all(timeout=10)
+        time.sleep(2)
+        num_workers = len(boss._SCALER.workers)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(num_workers, 1)
+
+    def test_tasks_of_retired_worker_requeued(self):
+        boss.start(action=slow_action, num_workers=2)
+        for i in range(4):
+            boss.assign_task(boss.Task(i, {}))
+
+        time.sleep(0.5)
+        worker = boss._WORKING_THREADS.pop()
+        worker.stop()
+        worker.join()
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(boss.stats()['done'], 4)
+
+    def test_finished_tasks_kept_without_command(self):
+        boss.start(action=half_done_half_failed_action)
+        for i in range(10):
+            boss.assign_task(boss.Task(i, {'uri': i}))
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(len(boss.tasks()), 10)
+        for k, v in boss.tasks().items():
+            self.assertIsNone(v.command)
+            self.assertEqual(v.is_done(), 0 == k % 2)
+
+    def test_assign_tasks(self):
+        boss.start(action=half_done_half_failed_action)
+        tasks = [boss.Task(i, {}) for i in range(100)]
+        self.assertEqual(boss.assign_tasks(tasks + tasks[:10]), 100)
+        self.assertEqual(boss.assign_tasks(tasks[:10]), 0)
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(boss.stats(), {'pending': 0, 'done': 50, 'failed': 50, 'total': 100})
+
+    def test_finished_tasks_journaled(self):
+        path = 'journal.todelete'
+        task_journal = journal.Journal(path, resume=False)
+        boss.start(action=half_done_half_failed_action, journal=task_journal)
+        for i in range(10):
+            boss.assign_task(boss.Task(i, {}))
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        task_journal.close()
+        done_tasks = journal.Journal(path).done_tasks()
+        os.remove(path)
+        self.assertTrue(all_done)
+        self.assertEqual(done_tasks, set(['0', '2', '4', '6', '8']))
+
+    def test_oldest_finished_tasks_evicted(self):
+        boss.start(action=done_action, max_finished_tasks=5)
+        for i in range(100):
+            boss.assign_task(boss.Task(i, {}))
+
+        all_done = boss.wait_all(timeout=10)
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(len(boss.tasks()), 5)
+        self.assertEqual(boss.stats(), {'pending': 0, 'done': 100, 'failed': 0, 'total': 100})
+
+    def test_late_result_of_evicted_task_ignored(self):
+        boss.start(action=done_action, max_finished_tasks=5)
+        for i in range(10):
+            boss.assign_task(boss.Task(i, {}))
+        all_done = boss.wait_all(timeout=10)
+
+        result_out = boss._CONTEXT.socket(boss.zmq.PUSH)
+        result_out.connect(boss._ENDPOINTS['result'])
+        late = boss.Task(0, {})
+        late.set_done()
+        result_out.send(boss._task_to_msg(late))
+        time.sleep(0.5)
+        result_out.close()
+        boss.stop()
+        self.assertTrue(all_done)
+        self.assertEqual(boss.stats(), {'pending': 0, 'done': 10, 'failed': 0, 'total': 10})
+
+    def test_stop_closes_wakeup_socket(self):
+        boss.start(action=done_action)
+        wakeup_socket = boss._TASK_WAKEUP_SOCKET
+        boss.stop()
+        self.assertTrue(wakeup_socket.closed)
+        self.assertIsNone(boss._TASK_WAKEUP_SOCKET)
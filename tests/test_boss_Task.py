@@ -1,4 +1,5 @@
 import unittest
+import heapq
 import boss
 
 
@@ -34,3 +35,90 @@ class TaskTest(unittest.TestCase):
     def teste_is_failed(self):
         task = boss.Task(1, {}, 'FAILED')
         self.assertTrue(task.is_failed())
+
+    def test_state(self):
+        self.assertEqual(boss.Task(1, {}).state(), 'pending')
+        self.assertEqual(boss.Task(1, {}, 'DONE').state(), 'done')
+        self.assertEqual(boss.Task(1, {}, 'FAILED').state(), 'failed')
+
+    def test_constructor_default_priority_and_deadline(self):
+        task = boss.Task(1, {})
+        self.assertEqual(task.priority, 0)
+        self.assertIsNone(task.deadline)
+
+    def test_constructor_default_attempts_and_retryable(self):
+        task = boss.Task(1, {})
+        self.assertEqual(task.attempts, 0)
+        self.assertTrue(task.retryable)
+
+    def test_retry_policy_should_retry(self):
+        policy = boss.RetryPolicy(max_attempts=2)
+        task = boss.Task(1, {}, 'FAILED')
+        task.attempts = 1
+        self.assertTrue(policy.should_retry(task))
+        task.attempts = 2
+        self.assertFalse(policy.should_retry(task))
+
+    def test_retry_policy_should_not_retry_fatal_error(self):
+        policy = boss.RetryPolicy(max_attempts=2)
+        task = boss.Task(1, {}, 'FAILED')
+        task.retryable = False
+        self.assertFalse(policy.should_retry(task))
+
+    def test_retry_policy_delay(self):
+        policy = boss.RetryPolicy(backoff=1, max_backoff=3, jitter=0.5)
+        self.assertTrue(0.5 <= policy.delay(1) <= 1)
+        self.assertTrue(1 <= policy.delay(2) <= 2)
+        self.assertTrue(1.5 <= policy.delay(5) <= 3)
+
+    def test_autoscale_policy_grows_for_backlog(self):
+        policy = boss.AutoscalePolicy(min_workers=1, max_workers=3)
+        self.assertEqual(policy.target(2, backlog=5, busy=2), 3)
+        self.assertEqual(policy.target(3, backlog=5, busy=3), 3)
+        self.assertEqual(policy.target(2, backlog=5, busy=2, ceiling=2), 2)
+
+    def test_autoscale_policy_shrinks_when_idle(self):
+        policy = boss.AutoscalePolicy(min_workers=1, max_workers=3)
+        self.assertEqual(policy.target(3, backlog=0, busy=0.5), 2)
+        self.assertEqual(policy.target(3, backlog=0, busy=2.5), 3)
+        self.assertEqual(policy.target(1, backlog=0, busy=0), 1)
+
+    def test_scaler_stops_growing_if_throughput_does_not_grow(self):
+        scaler = boss._ScalerThread(boss.AutoscalePolicy(min_workers=1, max_workers=10), None, 'thread', [None, None])
+        self.assertEqual(scaler._wanted_workers(backlog=10, busy=2, rate=100), 3)
+        scaler.workers.append(None)
+        self.assertEqual(scaler._wanted_workers(backlog=10, busy=3, rate=101), 2)
+        scaler.workers.pop()
+        self.assertEqual(scaler._wanted_workers(backlog=10, busy=2, rate=100), 2)
+        self.assertEqual(scaler._wanted_workers(backlog=0, busy=2, rate=100), 2)
+        self.assertEqual(scaler._wanted_workers(backlog=10, busy=2, rate=100), 3)
+
+    def test_finished_summary(self):
+        task = boss.Task(1, {'uri': 'http://host.com/a.ts'}, 'DONE', priority=2)
+        task.attempts = 2
+        summary = boss._finished_summary(task)
+        self.assertEqual(summary.id, 1)
+        self.assertIsNone(summary.command)
+        self.assertTrue(summary.is_done())
+        self.assertEqual(summary.priority, 2)
+        self.assertEqual(summary.attempts, 2)
+
+    def test_task_has_no_dict(self):
+        task = boss.Task(1, {})
+        self.assertFalse(hasattr(task, '__dict__'))
+
+    def test_task_msg_round_trip(self):
+        task = boss.Task('http://host.com/a.ts', {'uri': 'http://host.com/a.ts'}, 'FAILED', priority=3, deadline=12.5)
+        task.attempts = 2
+        task.retryable = False
+        msg = boss._task_to_msg(task)
+        task_from_msg = boss._task_from_msg(msg)
+        for k in boss.Task.__slots__:
+            self.assertEqual(getattr(task_from_msg, k), getattr(task, k))
+
+    def test_queue_tasks_by_priority(self):
+        del boss._TASK_QUEUE[:]
+        boss._queue_task(boss.Task('queued', {}, priority=1))
+        boss._queue_tasks([boss.Task(i, {}, priority=i % 3) for i in range(6)])
+        order = [heapq.heappop(boss._TASK_QUEUE)[-1].id for i in range(7)]
+        self.assertEqual(order, [2, 5, 'queued', 1, 4, 0, 3])
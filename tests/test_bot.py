@@ -14,6 +14,24 @@ class TastBot(unittest.TestCase):
     def test_num_worker(self):
         self.assertEqual(self.bot.num_worker, streambot._NUM_WORKER)
 
+    def test_min_and_max_worker(self):
+        self.assertEqual(self.bot.min_worker, streambot._MIN_WORKER)
+        self.assertIsNone(self.bot.max_worker)
+
+    def test_rate_limits(self):
+        self.assertEqual(self.bot.rate_limits, {})
+
+    def test_playlist_concurrency(self):
+        self.assertEqual(self.bot.playlist_concurrency, streambot._PLAYLIST_CONCURRENCY)
+
+    def test_cache(self):
+        self.assertIsNone(self.bot.cache_dir)
+        self.assertEqual(self.bot.cache_size, streambot._CACHE_SIZE)
+
+    def test_resume(self):
+        self.assertTrue(self.bot.resume)
+        self.assertEqual(self.bot.done_tasks, set())
+
     def test_refresh_interval(self):
         self.assertEqual(self.bot.refresh_interval, streambot._REFRESH_INTERVAL)
 
@@ -22,3 +40,25 @@ class TastBot(unittest.TestCase):
 
     def test_output_dir(self):
         self.assertEqual(self.bot.output_dir, os.path.join(os.getcwd(), streambot._OUTPUT_DIR))
+
+    def test_chunk_size(self):
+        self.assertEqual(self.bot.chunk_size, streambot._CHUNK_SIZE)
+
+    def test_boss_bind(self):
+        self.assertIsNone(self.bot.boss_bind)
+
+    def test_max_attempts(self):
+        self.assertEqual(self.bot.max_attempts, streambot._MAX_ATTEMPTS)
+
+    def test_engine(self):
+        self.assertEqual(self.bot.engine, streambot._ENGINE)
+        self.assertIs(self.bot.task_engine, streambot.boss)
+
+    def test_concurrency(self):
+        self.assertEqual(self.bot.concurrency, streambot._CONCURRENCY)
+        self.assertEqual(self.bot.host_concurrency, streambot._HOST_CONCURRENCY)
+
+    def test_start_engine_error_when_engine_unknown(self):
+        self.bot.engine = 'unknown'
+        with self.assertRaises(streambot.StreamBotError):
+            self.bot._start_engine()
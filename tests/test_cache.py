@@ -0,0 +1,71 @@
+import unittest
+import os
+import shutil
+import cache
+
+
+class TastSegmentCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = 'cache_dir'
+        self.output_dir = 'output_dir'
+        os.makedirs(self.output_dir)
+        self.cache = cache.SegmentCache(self.cache_dir, max_bytes=1000)
+
+    def tearDown(self):
+        for d in (self.cache_dir, self.output_dir):
+            if os.path.exists(d):
+                shutil.rmtree(d)
+
+    def _write(self, name, content):
+        local = os.path.join(self.output_dir, name)
+        with open(local, 'wb') as f:
+            f.write(content)
+        return local
+
+    def test_get_missing(self):
+        self.assertFalse(self.cache.get('http://example.com/s1.ts', os.path.join(self.output_dir, 'x.ts')))
+
+    def test_put_and_get(self):
+        self.cache.put('http://example.com/s1.ts', self._write('s1.ts', b'segment 1'))
+        local = os.path.join(self.output_dir, 'copy.ts')
+        self.assertTrue(self.cache.get('http://example.com/s1.ts', local))
+        with open(local, 'rb') as f:
+            self.assertEqual(f.read(), b'segment 1')
+
+    def test_same_content_stored_once(self):
+        self.cache.put('http://a.example.com/s1.ts', self._write('a.ts', b'segment 1'))
+        self.cache.put('http://b.example.com/s1.ts', self._write('b.ts', b'segment 1'))
+        self.assertEqual(len(self.cache.blobs), 1)
+        self.assertEqual(self.cache.total_bytes, len(b'segment 1'))
+
+    def test_evict_least_recently_used(self):
+        self.cache.put('http://example.com/s1.ts', self._write('s1.ts', b'1' * 400))
+        self.cache.put('http://example.com/s2.ts', self._write('s2.ts', b'2' * 400))
+        self.cache.get('http://example.com/s1.ts', os.path.join(self.output_dir, 'again.ts'))
+        self.cache.put('http://example.com/s3.ts', self._write('s3.ts', b'3' * 400))
+        self.assertTrue(self.cache.get('http://example.com/s1.ts', os.path.join(self.output_dir, 'x1.ts')))
+        self.assertFalse(self.cache.get('http://example.com/s2.ts', os.path.join(self.output_dir, 'x2.ts')))
+        self.assertTrue(self.cache.get('http://example.com/s3.ts', os.path.join(self.output_dir, 'x3.ts')))
+        self.assertLessEqual(self.cache.total_bytes, 1000)
+
+    def test_save_and_reopen(self):
+        self.cache.put('http://example.com/s1.ts', self._write('s1.ts', b'segment 1'))
+        self.cache.save()
+        reopened = cache.SegmentCache(self.cache_dir)
+        self.assertTrue(reopened.get('http://example.com/s1.ts', os.path.join(self.output_dir, 'copy.ts')))
+
+    def test_index_saved_without_close(self):
+        large = cache.SegmentCache(self.cache_dir, max_bytes=1000000)
+        for i in range(cache._SAVE_INTERVAL):
+            large.put('http://example.com/s{i}.ts'.format(i=i), self._write('s.ts', str(i).encode('utf-8')))
+        reopened = cache.SegmentCache(self.cache_dir)
+        self.assertTrue(reopened.get('http://example.com/s0.ts', os.path.join(self.output_dir, 'copy.ts')))
+
+    def test_unindexed_blobs_evicted_first(self):
+        self.cache.put('http://example.com/s1.ts', self._write('s1.ts', b'1' * 400))
+        self.cache.save()
+        self.cache.put('http://example.com/s2.ts', self._write('s2.ts', b'2' * 400))
+        reopened = cache.SegmentCache(self.cache_dir, max_bytes=1000)
+        reopened.put('http://example.com/s3.ts', self._write('s3.ts', b'3' * 400))
+        self.assertTrue(reopened.get('http://example.com/s1.ts', os.path.join(self.output_dir, 'x1.ts')))
+        self.assertEqual(reopened.total_bytes, 800)
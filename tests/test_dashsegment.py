@@ -27,3 +27,7 @@ class TastDASHSegment(unittest.TestCase):
         is_byterange = True
         with self.assertRaises(streambot.StreamBotError):
             dash_streambot.DASHSegment(uri, is_byterange)
+
+    def test_segment_has_no_dict(self):
+        segment = dash_streambot.DASHSegment('http://host.com/a.ts', False)
+        self.assertFalse(hasattr(segment, '__dict__'))
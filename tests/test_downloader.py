@@ -1,6 +1,8 @@
 import unittest
 import downloader
 import os
+import socket
+import time
 
 
 class TaskDownloader(unittest.TestCase):
@@ -11,6 +13,9 @@ class TaskDownloader(unittest.TestCase):
     def tearDown(self):
         if os.path.exists(self.local):
             os.remove(self.local)
+        if os.path.exists(downloader._partial(self.local)):
+            os.remove(downloader._partial(self.local))
+        downloader.close_session()
 
     def test_clear_local(self):
         f = open(self.local, 'wb')
@@ -32,3 +37,161 @@ class TaskDownloader(unittest.TestCase):
         r = downloader.download(self.uri, self.local)
         self.assertTrue(r)
         self.assertTrue(os.path.exists(self.local))
+
+    def test_download_counts_bytes(self):
+        before = downloader.bytes_downloaded()
+        r = downloader.download(self.uri, self.local)
+        self.assertTrue(r)
+        self.assertEqual(downloader.bytes_downloaded() - before, os.path.getsize(self.local))
+
+    def test_download_rate_limited(self):
+        downloader.set_rate_limit(bytes_per_second=64 * 1024)
+        start = time.time()
+        r = downloader.download(self.uri, self.local)
+        elapsed = time.time() - start
+        downloader.clear_rate_limits()
+        self.assertTrue(r)
+        self.assertTrue(elapsed >= os.path.getsize(self.local) / (64 * 1024.0) - 2)
+
+    def test_token_bucket(self):
+        bucket = downloader._TokenBucket(10)
+        self.assertEqual(bucket.reserve(10), 0)
+        self.assertTrue(0.4 < bucket.reserve(5) <= 0.5)
+        self.assertTrue(0.9 < bucket.reserve(5) <= 1)
+
+    def test_rate_limit_per_host(self):
+        downloader.set_rate_limit(requests_per_second=1, host='slow.example')
+        downloader.set_rate_limit(requests_per_second=100)
+        self.assertEqual(downloader._reserve('http://slow.example/a.ts', num_requests=1), 0)
+        self.assertTrue(downloader._reserve('http://slow.example/b.ts', num_requests=1) > 0.9)
+        self.assertEqual(downloader._reserve('http://fast.example/a.ts', num_requests=1), 0)
+        self.assertTrue(downloader._reserve('http://fast.example/b.ts', num_requests=1) < 0.1)
+        downloader.clear_rate_limits()
+        self.assertEqual(downloader._reserve('http://slow.example/c.ts', num_requests=1), 0)
+
+    def test_download_if_modified(self):
+        self.assertTrue(downloader.download_if_modified(self.uri, self.local))
+        self.assertFalse(downloader.download_if_modified(self.uri, self.local))
+        self.assertTrue(os.path.exists(self.local))
+
+    def test_download_if_modified_downloads_missing_local(self):
+        self.assertTrue(downloader.download_if_modified(self.uri, self.local))
+        os.remove(self.local)
+        self.assertTrue(downloader.download_if_modified(self.uri, self.local))
+        self.assertTrue(os.path.exists(self.local))
+
+    def test_conditional_headers(self):
+        uri = 'http://host.example/a.m3u8'
+        self.assertEqual(downloader._conditional_headers(uri), {})
+        downloader._VALIDATORS[uri] = {'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        headers = downloader._conditional_headers(uri)
+        del downloader._VALIDATORS[uri]
+        self.assertEqual(headers, {'If-None-Match': '"abc"', 'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+    def test_download_when_folder_created_meanwhile(self):
+        local = os.path.join('folder.todelete', 'local.todelete')
+        makedirs = os.makedirs
+
+        def racing_makedirs(path, *args):
+            # another thread creates the folder first
+            makedirs(path, *args)
+            raise OSError('File exists')
+
+        os.makedirs = racing_makedirs
+        try:
+            r = downloader.download(self.uri, local, raise_error=True)
+        finally:
+            os.makedirs = makedirs
+        self.assertTrue(r)
+        self.assertTrue(os.path.exists(local))
+        os.remove(local)
+        os.rmdir('folder.todelete')
+
+    def test_download_with_small_chunk_size(self):
+        r = downloader.download(self.uri, self.local, chunk_size=1024)
+        self.assertTrue(r)
+        self.assertTrue(os.path.getsize(self.local) > 1024)
+
+    def test_open_session_pool_size(self):
+        pool_size = 5
+        downloader.open_session(pool_size)
+        adapter = downloader._get_session().get_adapter(self.uri)
+        self.assertEqual(adapter._pool_maxsize, pool_size)
+
+    def test_session_is_shared(self):
+        self.assertIs(downloader._get_session(), downloader._get_session())
+
+    def test_close_session(self):
+        downloader.open_session()
+        downloader.close_session()
+        self.assertIsNone(downloader._SESSION)
+
+    def test_download_leaves_no_partial_file(self):
+        r = downloader.download(self.uri, self.local)
+        self.assertTrue(r)
+        self.assertFalse(os.path.exists(downloader._partial(self.local)))
+
+    def test_download_resumes_partial_file(self):
+        downloader.download(self.uri, self.local)
+        with open(self.local, 'rb') as f:
+            content = f.read()
+        os.remove(self.local)
+
+        with open(downloader._partial(self.local), 'wb') as f:
+            f.write(content[:1024])
+        r = downloader.download(self.uri, self.local)
+        self.assertTrue(r)
+        with open(self.local, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_download_range(self):
+        downloader.download(self.uri, self.local)
+        with open(self.local, 'rb') as f:
+            content = f.read()
+        os.remove(self.local)
+
+        downloader.download_range(self.uri, self.local, 1000, 1999)
+        downloader.download_range(self.uri, self.local, 0, 999)
+        with open(self.local, 'rb') as f:
+            self.assertEqual(f.read(), content[:2000])
+
+    def test_clear_local_removes_partial_file(self):
+        with open(downloader._partial(self.local), 'wb') as f:
+            f.write(b'garbage')
+        downloader.download(self.uri, self.local, clear_local=True)
+        with open(self.local, 'rb') as f:
+            self.assertNotEqual(f.read(7), b'garbage')
+
+    def test_download_raises_retryable_error_if_host_invalid(self):
+        uri = r'http://bad.url.example/not.exist'
+        with self.assertRaises(downloader.DownloadError) as cm:
+            downloader.download(uri, self.local, raise_error=True)
+        self.assertTrue(cm.exception.retryable)
+
+    def test_download_raises_retryable_error_if_server_stalls(self):
+        # a server that accepts the connection and never responds
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        uri = 'http://127.0.0.1:{port}/stalled.ts'.format(port=server.getsockname()[1])
+        timeout = downloader._TIMEOUT
+        downloader._TIMEOUT = (1, 0.5)
+        try:
+            with self.assertRaises(downloader.DownloadError) as cm:
+                downloader.download(uri, self.local, raise_error=True)
+        finally:
+            downloader._TIMEOUT = timeout
+            server.close()
+        self.assertTrue(cm.exception.retryable)
+
+    def test_download_raises_fatal_error_if_not_found(self):
+        uri = r'https://bootstrap.pypa.io/not.exist'
+        with self.assertRaises(downloader.DownloadError) as cm:
+            downloader.download(uri, self.local, raise_error=True)
+        self.assertFalse(cm.exception.retryable)
+
+    def test_retryable_status(self):
+        for status in (408, 429, 500, 503, 507, 520, 524):
+            self.assertTrue(downloader._is_retryable_status(status))
+        for status in (400, 403, 404, 416):
+            self.assertFalse(downloader._is_retryable_status(status))
@@ -2,6 +2,8 @@ import unittest
 import os
 import shutil
 
+import m3u8
+
 import streambot
 import hls_streambot
 
@@ -55,6 +57,11 @@ class TastHLSPlaylist(unittest.TestCase):
         segments = self.media_playlist.parse_segments()
         self.assertEqual(len(segments), 181)
 
+    def test_media_playlist_parse_segments_sequence(self):
+        self.media_playlist.download_and_save(self.output_dir)
+        segments = self.media_playlist.parse_segments()
+        self.assertEqual([s.sequence for s in segments[:3]], [0, 1, 2])
+
     def test_media_playlist_is_live(self):
         self.media_playlist.download_and_save(self.output_dir)
         self.assertFalse(self.media_playlist.is_live())
@@ -62,3 +69,61 @@ class TastHLSPlaylist(unittest.TestCase):
     def test_media_playlist_target_duration(self):
         self.media_playlist.download_and_save(self.output_dir)
         self.assertEqual(self.media_playlist.target_duration(), 11)
+
+    def test_download_playlists(self):
+        self.master_playlist.download_and_save(self.output_dir)
+        playlists = self.master_playlist.parse_media_playlists()
+        downloaded = list(hls_streambot.download_playlists(playlists, self.output_dir))
+        self.assertEqual(len(downloaded), len(playlists))
+        for p in downloaded:
+            self.assertIsNotNone(p.playlist)
+
+    def test_download_playlists_skips_failed_playlist(self):
+        bad_playlist = hls_streambot.HLSPlaylist('http://bad.url.example/not.exist.m3u8')
+        downloaded = list(hls_streambot.download_playlists([bad_playlist, self.media_playlist], self.output_dir))
+        self.assertEqual(downloaded, [self.media_playlist])
+
+    def test_changed(self):
+        self.assertTrue(self.media_playlist.changed)
+        self.media_playlist.download_and_save(self.output_dir)
+        self.assertTrue(self.media_playlist.changed)
+        self.media_playlist.download_and_save(self.output_dir)
+        self.assertFalse(self.media_playlist.changed)
+
+    def test_reload_delay(self):
+        self.media_playlist.playlist = m3u8.loads('#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXTINF:6,\ns0.ts\n')
+        self.assertEqual(self.media_playlist.reload_delay(), 6)
+        self.media_playlist.changed = False
+        self.assertEqual(self.media_playlist.reload_delay(), 3)
+
+    def _live_playlist(self, media_sequence, num_segments):
+        content = '#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:{n}\n'.format(n=media_sequence)
+        for i in range(media_sequence, media_sequence + num_segments):
+            content += '#EXTINF:6,\ns{i}.ts\n'.format(i=i)
+        return m3u8.loads(content)
+
+    def test_parse_new_segments(self):
+        self.media_playlist.playlist = self._live_playlist(10, 3)
+        self.assertEqual([s.sequence for s in self.media_playlist.parse_new_segments()], [10, 11, 12])
+        self.assertEqual(self.media_playlist.parse_new_segments(), [])
+        self.media_playlist.playlist = self._live_playlist(11, 3)
+        segments = self.media_playlist.parse_new_segments()
+        self.assertEqual([s.sequence for s in segments], [13])
+        self.assertTrue(segments[0].uri.endswith('/s13.ts'))
+        self.assertEqual(self.media_playlist.missed_segments, 0)
+
+    def test_parse_new_segments_counts_missed_segments(self):
+        self.media_playlist.playlist = self._live_playlist(10, 3)
+        self.media_playlist.parse_new_segments()
+        self.media_playlist.playlist = self._live_playlist(15, 3)
+        self.assertEqual([s.sequence for s in self.media_playlist.parse_new_segments()], [15, 16, 17])
+        self.assertEqual(self.media_playlist.missed_segments, 2)
+
+    def test_parse_segments_byterange(self):
+        content = '#EXTM3U\n#EXT-X-TARGETDURATION:6\n#EXT-X-ENDLIST\n'
+        content += '#EXTINF:6,\n#EXT-X-BYTERANGE:1000@500\nall.ts\n'
+        content += '#EXTINF:6,\n#EXT-X-BYTERANGE:2000\nall.ts\n'
+        content += '#EXTINF:6,\nother.ts\n'
+        self.media_playlist.playlist = m3u8.loads(content)
+        segments = self.media_playlist.parse_segments()
+        self.assertEqual([s.byterange for s in segments], [(500, 1499), (1500, 3499), None])
@@ -17,8 +17,16 @@ class TastHLSSegment(unittest.TestCase):
         self.assertEqual(segment.uri, uri)
         self.assertEqual(segment.is_byterange, is_byterange)
 
+    def test_constructor_default_sequence_none(self):
+        segment = hls_streambot.HLSSegment('http://example.com/1.ts', False)
+        self.assertIsNone(segment.sequence)
+
     def test_constructor_error_when_uri_is_not_full(self):
         uri = 'asdf'
         is_byterange = True
         with self.assertRaises(streambot.StreamBotError):
             hls_streambot.HLSSegment(uri, is_byterange)
+
+    def test_segment_has_no_dict(self):
+        segment = hls_streambot.HLSSegment('http://host.com/a.ts', False)
+        self.assertFalse(hasattr(segment, '__dict__'))
@@ -0,0 +1,56 @@
+import unittest
+import os
+import journal
+
+
+class TastJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = 'journal.todelete'
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_done_tasks_replayed(self):
+        j = journal.Journal(self.path)
+        j.record('http://example.com/s1.ts', 'done')
+        j.record('http://example.com/s2.ts', 'failed')
+        j.close()
+        self.assertEqual(journal.Journal(self.path).done_tasks(), set(['http://example.com/s1.ts']))
+
+    def test_last_state_wins(self):
+        j = journal.Journal(self.path)
+        j.record('http://example.com/s1.ts', 'failed')
+        j.record('http://example.com/s1.ts', 'done')
+        j.record('http://example.com/s2.ts', 'done')
+        j.record('http://example.com/s2.ts', 'failed')
+        j.close()
+        self.assertEqual(journal.Journal(self.path).done_tasks(), set(['http://example.com/s1.ts']))
+
+    def test_no_resume_starts_over(self):
+        j = journal.Journal(self.path)
+        j.record('http://example.com/s1.ts', 'done')
+        j.close()
+        self.assertEqual(journal.Journal(self.path, resume=False).done_tasks(), set())
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_line_cut_short_dropped(self):
+        j = journal.Journal(self.path)
+        j.record('http://example.com/s1.ts', 'done')
+        j.close()
+        with open(self.path, 'ab') as f:
+            f.write(b'D http://example.com/s2')
+        j = journal.Journal(self.path)
+        j.record('http://example.com/s3.ts', 'done')
+        j.close()
+        self.assertEqual(journal.Journal(self.path).done_tasks(), set(['http://example.com/s1.ts', 'http://example.com/s3.ts']))
+
+    def test_compacted_on_open(self):
+        j = journal.Journal(self.path)
+        for i in range(10):
+            j.record('http://example.com/s1.ts', 'failed')
+        j.record('http://example.com/s1.ts', 'done')
+        j.close()
+        journal.Journal(self.path).close()
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'D http://example.com/s1.ts\n')
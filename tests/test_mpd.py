@@ -1,10 +1,73 @@
 import unittest
 import os
 import shutil
+from mpegdash.parser import MPEGDASHParser
 import streambot
 import dash_streambot
 
 
+_TEMPLATE_MPD = '''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT9S" minBufferTime="PT2S">
+  <BaseURL>media/</BaseURL>
+  <Period>
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" duration="4000" startNumber="1"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number%03d$.m4s"/>
+      <Representation id="v1" bandwidth="500000"/>
+      <Representation id="v2" bandwidth="900000">
+        <SegmentTemplate media="$Bandwidth$/$Number$.m4s"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+'''
+
+_TIMELINE_MPD = '''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT10S" minBufferTime="PT2S">
+  <Period duration="PT10S">
+    <SegmentTemplate timescale="10" media="$RepresentationID$/$Time$.m4s">
+      <SegmentTimeline>
+        <S t="0" d="20" r="2"/>
+        <S d="10"/>
+        <S d="15" r="-1"/>
+      </SegmentTimeline>
+    </SegmentTemplate>
+    <AdaptationSet mimeType="audio/mp4">
+      <Representation id="a1" bandwidth="64000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+'''
+
+_LIVE_MPD = '''<?xml version="1.0"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="dynamic" availabilityStartTime="2020-01-01T00:00:00Z"
+     minimumUpdatePeriod="PT10S" timeShiftBufferDepth="PT30S" suggestedPresentationDelay="PT6S"
+     minBufferTime="PT2S" maxSegmentDuration="PT2S">
+  <Period id="1" start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" duration="2000" startNumber="0"
+                       initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/$Number$.m4s"/>
+      <Representation id="v1" bandwidth="500000"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4">
+      <SegmentTemplate timescale="10" media="$RepresentationID$/$Time$.m4s">
+        <SegmentTimeline>
+          <S t="100" d="20" r="-1"/>
+        </SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="a1" bandwidth="64000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+'''
+
+
+def _mpd(content, uri='http://example.com/dash/manifest.mpd'):
+    mpd = dash_streambot.MPD(uri)
+    mpd.mpd = MPEGDASHParser.parse(content)
+    return mpd
+
+
 class TastMPD(unittest.TestCase):
     def setUp(self):
         self.vod_url = r'http://dash.akamaized.net/dash264/TestCases/1a/netflix/exMPD_BIP_TC1.mpd'
@@ -46,3 +109,97 @@ class TastMPD(unittest.TestCase):
         self.assertEqual(segments[4].uri, r'http://dash.edgesuite.net/dash264/TestCases/1a/netflix/ElephantsDream_H264BPL30_0500.264.dash')
         for s in segments:
             self.assertFalse(s.is_byterange)
+
+    def test_iter_segments_is_generator(self):
+        segments = _mpd(_TEMPLATE_MPD).iter_segments()
+        self.assertEqual(next(segments).uri, 'http://example.com/dash/media/v1/init.mp4')
+
+    def test_parse_segments_template_number(self):
+        segments = _mpd(_TEMPLATE_MPD).parse_segments()
+        self.assertEqual([s.uri for s in segments], [
+            'http://example.com/dash/media/v1/init.mp4',
+            'http://example.com/dash/media/v1/001.m4s',
+            'http://example.com/dash/media/v1/002.m4s',
+            'http://example.com/dash/media/v1/003.m4s',
+            'http://example.com/dash/media/v2/init.mp4',
+            'http://example.com/dash/media/900000/1.m4s',
+            'http://example.com/dash/media/900000/2.m4s',
+            'http://example.com/dash/media/900000/3.m4s',
+        ])
+
+    def test_parse_segments_template_timeline(self):
+        segments = _mpd(_TIMELINE_MPD).parse_segments()
+        self.assertEqual([s.uri for s in segments], [
+            'http://example.com/dash/a1/0.m4s',
+            'http://example.com/dash/a1/20.m4s',
+            'http://example.com/dash/a1/40.m4s',
+            'http://example.com/dash/a1/60.m4s',
+            'http://example.com/dash/a1/70.m4s',
+            'http://example.com/dash/a1/85.m4s',
+        ])
+
+    def test_parse_duration(self):
+        self.assertEqual(dash_streambot._parse_duration('PT1H2M3.5S'), 3723.5)
+        self.assertEqual(dash_streambot._parse_duration('P1DT1S'), 86401)
+        self.assertIsNone(dash_streambot._parse_duration(None))
+
+    def test_expand_template(self):
+        uri = dash_streambot._expand_template('$RepresentationID$_$Bandwidth$_$Time$_$Number%05d$$$.m4s', 'v1', 42, 500000, 9000)
+        self.assertEqual(uri, 'v1_500000_9000_00042$.m4s')
+
+    def test_iter_segments_live_window(self):
+        segments = _mpd(_LIVE_MPD).iter_segments((10, 16))
+        self.assertEqual([s.uri for s in segments], [
+            'http://example.com/dash/v1/init.mp4',
+            'http://example.com/dash/v1/5.m4s',
+            'http://example.com/dash/v1/6.m4s',
+            'http://example.com/dash/v1/7.m4s',
+            'http://example.com/dash/a1/100.m4s',
+            'http://example.com/dash/a1/120.m4s',
+            'http://example.com/dash/a1/140.m4s',
+        ])
+
+    def test_iter_segments_end(self):
+        segments = list(_mpd(_LIVE_MPD).iter_segments((10, 16)))
+        self.assertEqual([s.end for s in segments], [None, 12, 14, 16, 12, 14, 16])
+
+    def test_live_segments_queued_by_end_and_buffer_depth(self):
+        bot = dash_streambot.DASHStreamBot('http://example.com/dash/manifest.mpd')
+        bot.mpd = _mpd(_LIVE_MPD)
+        tasks = []
+        bot._assign_tasks = tasks.extend
+        bot._queue_segments((10, 16))
+        media = dict((t.id, t) for t in tasks)
+        init = media['http://example.com/dash/v1/init.mp4']
+        self.assertEqual(init.priority, 16)
+        self.assertEqual(init.deadline, 1577836800 + 16 + 30)
+        self.assertEqual(media['http://example.com/dash/v1/5.m4s'].priority, 12)
+        self.assertEqual(media['http://example.com/dash/v1/7.m4s'].priority, 16)
+        self.assertEqual(media['http://example.com/dash/v1/7.m4s'].deadline, 1577836800 + 16 + 30)
+
+    def test_live_timing(self):
+        mpd = _mpd(_LIVE_MPD)
+        self.assertTrue(mpd.is_live())
+        self.assertEqual(mpd.availability_start(), 1577836800)
+        self.assertEqual(mpd.update_period(), 10)
+        self.assertEqual(mpd.presentation_delay(), 6)
+        self.assertEqual(mpd.buffer_depth(), 30)
+        self.assertEqual(mpd.poll_interval(), 2)
+
+    def test_zero_update_period_polls_once_per_segment(self):
+        mpd = _mpd(_LIVE_MPD.replace('minimumUpdatePeriod="PT10S"', 'minimumUpdatePeriod="PT0S"'))
+        self.assertEqual(mpd.update_period(), 0)
+        self.assertEqual(mpd.poll_interval(), 2)
+
+        mpd = _mpd(_LIVE_MPD.replace('minimumUpdatePeriod="PT10S"', 'minimumUpdatePeriod="PT0S"').replace(' maxSegmentDuration="PT2S"', ''))
+        self.assertEqual(mpd.poll_interval(), dash_streambot._LIVE_INTERVAL)
+
+    def test_static_mpd_does_not_update(self):
+        mpd = _mpd(_TEMPLATE_MPD)
+        self.assertFalse(mpd.is_live())
+        self.assertIsNone(mpd.update_period())
+
+    def test_parse_datetime(self):
+        self.assertEqual(dash_streambot._parse_datetime('2020-01-01T00:00:00Z'), 1577836800)
+        self.assertEqual(dash_streambot._parse_datetime('2020-01-01T01:00:00.5+01:00'), 1577836800.5)
+        self.assertIsNone(dash_streambot._parse_datetime(None))
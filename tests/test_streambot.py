@@ -34,6 +34,55 @@ class TastStreamBot(unittest.TestCase):
         self.assertEqual(task.command['uri'], uri)
         self.assertEqual(task.command['local'], local)
         self.assertEqual(task.command['clear_local'], clear_local)
+        self.assertEqual(task.command['chunk_size'], streambot._CHUNK_SIZE)
+
+    def test_create_download_task_chunk_size(self):
+        uri = 'http://example.com/x.pdf'
+        output_dir = 'output_dir'
+        chunk_size = 1024
+        task = streambot.create_download_task(uri, output_dir, chunk_size=chunk_size)
+        self.assertEqual(task.command['chunk_size'], chunk_size)
+
+    def test_create_download_task_priority_and_deadline(self):
+        uri = 'http://example.com/x.pdf'
+        output_dir = 'output_dir'
+        task = streambot.create_download_task(uri, output_dir, priority=10, deadline=100)
+        self.assertEqual(task.priority, 10)
+        self.assertEqual(task.deadline, 100)
+
+    def test_create_download_task_byterange(self):
+        uri = 'http://example.com/x.mp4'
+        task = streambot.create_download_task(uri, 'output_dir', byterange=(100, 199))
+        self.assertEqual(task.id, uri + '#bytes=100-199')
+        self.assertEqual(task.command['uri'], uri)
+        self.assertEqual(task.command['byterange'], [100, 199])
+
+    def test_byterange_tasks_done_on_first_attempt(self):
+        uri = r'https://bootstrap.pypa.io/get-pip.py'
+        output_dir = 'output_dir'
+        tasks = [streambot.create_download_task(uri, output_dir, byterange=r) for r in [(0, 999), (1000, 1999)]]
+        streambot.boss.start(action=streambot._download_task_action, retry_policy=streambot.boss.RetryPolicy(max_attempts=3, backoff=0.1))
+        streambot.boss.assign_tasks(tasks)
+
+        all_done = streambot.boss.wait_all(timeout=30)
+        finished = streambot.boss.tasks()
+        stats = streambot.boss.stats()
+        streambot.boss.stop()
+        shutil.rmtree(output_dir)
+        self.assertTrue(all_done)
+        self.assertEqual(stats['done'], 2)
+        for task in tasks:
+            self.assertTrue(finished[task.id].is_done())
+            self.assertEqual(finished[task.id].attempts, 1)
+
+    def test_coalesce_byteranges(self):
+        byteranges = [(200, 299), (0, 99), (100, 199), (150, 249), (400, 499)]
+        self.assertEqual(streambot.coalesce_byteranges(byteranges), [(0, 299), (400, 499)])
+
+    def test_coalesce_byteranges_splits_into_parts(self):
+        byteranges = [(i * 100, i * 100 + 99) for i in range(10)]
+        self.assertEqual(streambot.coalesce_byteranges(byteranges, 4, min_size=100), [(0, 249), (250, 499), (500, 749), (750, 999)])
+        self.assertEqual(streambot.coalesce_byteranges(byteranges, 4, min_size=600), [(0, 599), (600, 999)])
 
     def test_create_download_task_error_when_uri_not_full(self):
         uri = 'asdf'
@@ -61,3 +110,15 @@ class TastStreamBot(unittest.TestCase):
 
         if os.path.exists(output_dir):
             shutil.rmtree(output_dir)
+
+    def test_refresh_and_save_to_error_when_uri_not_full(self):
+        with self.assertRaises(streambot.StreamBotError):
+            streambot.refresh_and_save_to('asdf', 'output_dir')
+
+    def test_refresh_and_save_to_error_when_download_fail(self):
+        output_dir = 'output_dir'
+        with self.assertRaises(streambot.StreamBotError):
+            streambot.refresh_and_save_to('http://not.exist/a.m3u8', output_dir)
+
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)